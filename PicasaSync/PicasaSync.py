@@ -4,87 +4,128 @@ import sys
 if sys.hexversion < 0x020700F0:
 	raise SystemExit('This scripts needs at least Python 2.7')
 
-import logging, os, mimetypes, argparse, urllib, multiprocessing, threading, calendar, re, cStringIO, itertools
-
-try:
-	import googlecl
-except ImportError:
-	raise SystemExit('Error importing the googlecl module. In debian/ubuntu you can install it by doing "sudo apt-get install googlecl"')
-import googlecl.authentication
-import googlecl.config
-import googlecl.picasa as picasa
-import googlecl.picasa.service as picasa_service
-
-import atom
-import gdata.photos
-from gdata.photos.service import GooglePhotosException
-
-try:
-	import pyexiv2
-except ImportError:
-	raise SystemExit('Error importing the pyexiv2 module. In debian/ubuntu you can install it by doing "sudo apt-get install python-pyexiv2"')
-
-try:
-	import dateutil.parser
-except ImportError:
-	raise SystemExit('Error importing the dateutil module. In debian/ubuntu you can install it by doing "sudo apt-get install python-dateutil"')
-
-try:
-	import Image
-except ImportError:
-	raise SystemExit('Error importing the Image module. In debian/ubuntu you can install it by doing "sudo apt-get install python-imaging"')
-
-# .jpe is not a sane extension for jpeg
-mimetypes.init()
-if hasattr(mimetypes, '_db') and hasattr(mimetypes._db, 'types_map_inv') and mimetypes._db.types_map_inv[True].has_key('image/jpeg') and '.jpe' in mimetypes._db.types_map_inv[True]['image/jpeg']:
-	mimetypes._db.types_map_inv[True]['image/jpeg'].remove('.jpe')
+import logging, os, mimetypes, argparse, functools, multiprocessing, multiprocessing.pool, threading, Queue, calendar, time, cStringIO, sqlite3, urlparse, json
 
+from lazy import googlecl, picasa, picasa_service, atom, gdata, pyexiv2, dateutil, Image
 from dryrun import dryrun
+from state import StateDB, fingerprint
+from exif import read_datetimes, ExifError
+from filedate import filename_timestamp
+from workqueue import WorkQueue, ClientPool, ByteBudget, TaskGroup
+from download import DownloadEngine
+from batch import BatchQueue
+from transform import timed_transform_photo, TransformError, TransformPipeline, TransformCache
+from plan import PlanWriter, read_plan, plan_options
+from journal import Journal
+from ratelimit import RequestLayer
+from metrics import metrics, Profiler
+
+def _init_mimetypes():
+	mimetypes.init()
+	# .jpe is not a sane extension for jpeg
+	if hasattr(mimetypes, '_db') and hasattr(mimetypes._db, 'types_map_inv') and mimetypes._db.types_map_inv[True].has_key('image/jpeg') and '.jpe' in mimetypes._db.types_map_inv[True]['image/jpeg']:
+		mimetypes._db.types_map_inv[True]['image/jpeg'].remove('.jpe')
 
 def _entry_ts(entry):
 	return int(long(entry.timestamp.text) / 1000)
 
+def _entry_updated(entry):
+	return calendar.timegm(dateutil.parser.parse(entry.updated.text).utctimetuple())
+
+def _parse_time(arg):
+	return calendar.timegm(dateutil.parser.parse(arg).utctimetuple())
+
+def _parse_size(arg):
+	units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+	if arg[-1:].upper() in units:
+		return int(arg[:-1]) * units[arg[-1:].upper()]
+	return int(arg)
+
 class InvalidArguments(Exception): pass
 
 class PhotoDiskEntry(object):
-	def __init__(self, cl_args, path, album_path = None):
+	"""Local side of a photo. With a state database, the stat fields and the state of the file are kept too."""
+	__slots__ = ('path', 'timestamp', 'size', 'mtime', 'inode', 'fingerprint', 'picasa_id', 'picasa_timestamp')
+
+	def __init__(self, cl_args, path, album_path = None, state = None):
 		path = googlecl.safe_decode(path)
 		self.path = path
 		self.timestamp = None
+		self.size = self.mtime = self.inode = None
+		self.fingerprint = self.picasa_id = self.picasa_timestamp = None
 		if album_path:
 			path = os.path.join(album_path, path)
 		if 'stat' not in cl_args.origin:
 			cl_args.origin.append('stat')
+		st = None
+		if state:
+			try:
+				st = os.stat(path)
+			except EnvironmentError:
+				pass
+			else:
+				record = state.lookup(path, st, cl_args.origin)
+				if record:
+					self.timestamp = record.timestamp
+					self.keep(st, record)
+					return
+		self.timestamp = self.probe(cl_args, path, st)
+		if state and st and self.timestamp:
+			state.store(path, st, cl_args.origin, self.timestamp, mimetypes.guess_type(path)[0])
+			self.keep(st)
+
+	def keep(self, st, record = None):
+		# Only the fields read while syncing, the whole stat result and state record are much bigger
+		self.size, self.mtime, self.inode = st.st_size, st.st_mtime, st.st_ino
+		if record:
+			self.fingerprint, self.picasa_id, self.picasa_timestamp = record.fingerprint, record.picasa_id, record.picasa_timestamp
+
+	@classmethod
+	def restore(cls, path, timestamp):
+		"""Build an entry from a plan without touching the disk."""
+		self = cls.__new__(cls)
+		self.path = path
+		self.timestamp = timestamp
+		self.size = self.mtime = self.inode = None
+		self.fingerprint = self.picasa_id = self.picasa_timestamp = None
+		return self
+
+	def probe(self, cl_args, path, st = None):
 		for origin in cl_args.origin:
 			if origin == 'stat':
 				try:
-					self.timestamp = int(os.stat(path).st_mtime)
-					break
+					return int((st or os.stat(path)).st_mtime)
 				except Exception:
 					pass
 			elif origin == 'exif':
-				metadata = pyexiv2.ImageMetadata(path)
-				try:
-					metadata.read()
-					if 'Exif.Image.DateTime' in metadata:
-						self.timestamp = calendar.timegm(metadata['Exif.Image.DateTime'].value.timetuple())
-						break
-				except Exception:
-					pass
-			else:
-				for m in re.finditer(r'\d', self.path):
+				with metrics.timer('exif_read'):
 					try:
-						self.timestamp = calendar.timegm(dateutil.parser.parse(m.string[m.start():], fuzzy = True, dayfirst = True).timetuple())
-						break
-					except ValueError:
+						timestamp = read_datetimes(path).get('DateTime')
+					except (ExifError, EnvironmentError):
 						pass
-				if self.timestamp:
-					break
+					else:
+						if timestamp:
+							return timestamp
+						continue
+					metadata = pyexiv2.ImageMetadata(path)
+					try:
+						metadata.read()
+						if 'Exif.Image.DateTime' in metadata:
+							return calendar.timegm(metadata['Exif.Image.DateTime'].value.timetuple())
+					except Exception:
+						pass
+			else:
+				timestamp = filename_timestamp(self.path)
+				if timestamp:
+					return timestamp
+		return None
 
 class AlbumDiskEntry(object):
 	def __init__(self, cl_args, path):
 		self.path = googlecl.safe_decode(path)
 		self.timestamp = None
+		# Newest modification time of the directory and its photos, set when the album is filled from disk
+		self.mtime = None
 		if 'stat' not in cl_args.origin:
 			cl_args.origin.append('stat')
 		for origin in cl_args.origin:
@@ -95,44 +136,107 @@ class AlbumDiskEntry(object):
 				except Exception:
 					pass
 			elif origin == 'filename':
-				for m in re.finditer(r'\d', self.path):
-					try:
-						self.timestamp = calendar.timegm(dateutil.parser.parse(m.string[m.start():], fuzzy = True, dayfirst = True).timetuple())
-						break
-					except ValueError:
-						pass
+				self.timestamp = filename_timestamp(self.path)
 				if self.timestamp:
 					break
 
+	@classmethod
+	def restore(cls, path, timestamp):
+		"""Build an entry from a plan without touching the disk."""
+		self = cls.__new__(cls)
+		self.path = path
+		self.timestamp = timestamp
+		self.mtime = None
+		return self
+
+class PhotoPicasaEntry(object):
+	"""The fields of a remote photo that syncing needs, kept instead of the whole gdata entry.
+
+	The full entry is fetched again from the edit link when it has to be sent back modified.
+	"""
+	__slots__ = ('id', 'uri', 'title', 'timestamp', 'type', 'src', 'size', 'checksum', 'edit', 'edit_media')
+
+	def __init__(self, entry):
+		self.id = entry.gphoto_id.text
+		self.uri = entry.id.text if entry.id else None
+		self.title = entry.title.text
+		self.timestamp = _entry_ts(entry)
+		self.type = entry.content.type if entry.content else None
+		self.src = entry.content.src if entry.content else None
+		self.size = long(entry.size.text) if entry.size and entry.size.text else None
+		self.checksum = entry.checksum.text if entry.checksum and entry.checksum.text else None
+		link = entry.GetEditLink()
+		self.edit = link and link.href
+		link = entry.GetEditMediaLink()
+		self.edit_media = link and link.href
+
+	@classmethod
+	def restore(cls, description):
+		"""Build an entry from a plan, a journal or the state database."""
+		self = cls.__new__(cls)
+		for field in cls.__slots__:
+			setattr(self, field, description[field])
+		return self
+
+	def describe(self):
+		return dict((field, getattr(self, field)) for field in self.__slots__)
+
 class Photo(object):
 	LOG = logging.getLogger('Photo')
-	transforms = {
-			1 : (),
-			2 : (Image.FLIP_LEFT_RIGHT,),
-			3 : (Image.ROTATE_180,),
-			4 : (Image.FLIP_TOP_BOTTOM,),
-			5 : (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM),
-			6 : (Image.ROTATE_270,),
-			7 : (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
-			8 : (Image.ROTATE_90,)
-			}
+	__slots__ = ('album', 'disk', 'picasa', 'raw', 'moved_from', 'title')
 
 	def __init__(self, album, title = None, disk = None, picasa = None, raw = False):
 		self.album = album
 		self.disk = disk
 		self.picasa = picasa
 		self.raw = raw
+		self.moved_from = None
 		if not title:
 			if disk:
 				self.title = os.path.splitext(disk.path)[0]
 			elif picasa:
-				self.title = picasa.title.text
+				self.title = picasa.title
 			else:
 				raise InvalidArguments("No title for photo given and no valid entry found")
 		else:
 			self.title = title
 		self.title = googlecl.safe_decode(self.title)
 
+	@classmethod
+	def restore(cls, album, description):
+		disk = description['disk'] and PhotoDiskEntry.restore(description['disk']['path'], description['disk']['timestamp'])
+		picasa = description['picasa'] and PhotoPicasaEntry.restore(description['picasa'])
+		return cls(album, description['title'], disk = disk, picasa = picasa, raw = description['raw'])
+
+	def describe(self):
+		return {
+			'title': self.title,
+			'disk': self.disk and {'path': self.disk.path, 'timestamp': self.disk.timestamp},
+			'picasa': self.picasa and self.picasa.describe(),
+			'raw': self.raw,
+		}
+
+	def act(self, op, reason):
+		"""Run the operation op, or only add it to the plan when planning."""
+		if not self.album.plan:
+			getattr(self, op)(reason = reason)
+			return
+		size = 0
+		if op == 'upload' and not (self.isInPicasa() and self.album.cl_args.force_update == 'metadata'):
+			try:
+				size = self.size()
+			except EnvironmentError:
+				pass
+		elif op == 'download' and self.picasa.size:
+			size = self.picasa.size
+		self.album.plan.addAlbum(self.album)
+		action = {'kind': 'photo', 'op': op, 'album': self.album.title, 'photo': self.title, 'reason': reason, 'bytes': size, 'entry': self.describe()}
+		if op == 'move':
+			action['moved_from'] = self.moved_from.describe()
+			self.album.plan.addAlbum(self.moved_from.album)
+			action['moved_from_album'] = self.moved_from.album.title
+		self.album.plan.add(action)
+
 	@apply
 	def path():
 		def fget(self):
@@ -156,159 +260,317 @@ class Photo(object):
 	def isRaw(self):
 		return self.raw
 
+	def picasaEntry(self):
+		"""Fetch the whole remote entry, to send it back modified."""
+		return self.album.client.Get(self.picasa.edit, converter = gdata.photos.PhotoEntryFromString)
+
+	def size(self):
+		if self.disk.size is not None:
+			return self.disk.size
+		return os.path.getsize(self.path)
+
+	def fingerprint(self):
+		if self.disk.fingerprint:
+			return self.disk.fingerprint
+		result = fingerprint(self.path)
+		if self.album.state and self.disk.mtime is not None:
+			self.album.state.storeFingerprint(self.path, self.disk.size, self.disk.mtime, self.disk.inode, result)
+			self.disk.fingerprint = result
+		return result
+
+	def isSynced(self):
+		if not self.album.state or not self.disk.picasa_id:
+			return False
+		return self.disk.picasa_id == self.picasa.id and self.disk.picasa_timestamp == self.picasa.timestamp
+
+	def markSynced(self):
+		if not self.album.state or not self.isInDisk() or not self.isInPicasa():
+			return
+		try:
+			st = os.stat(self.path)
+		except EnvironmentError:
+			return
+		self.album.state.markSynced(self.path, st, self.picasa.id, self.picasa.timestamp)
+
+	def journal(self, op):
+		if not self.album.journal:
+			return
+		try:
+			st = os.stat(self.path)
+		except EnvironmentError:
+			return
+		self.album.journal.photoSynced(op, self.path, st, self.picasa.describe())
+
+	def isResumed(self):
+		"""Check whether the interrupted run being resumed already synced this photo."""
+		if not self.album.journal or not self.isInDisk():
+			return False
+		entry = self.album.journal.photo(self.path)
+		if not entry:
+			return False
+		entry = PhotoPicasaEntry.restore(entry)
+		# The remote photo changed after it was synced
+		if self.isInPicasa() and (self.picasa.id != entry.id or self.picasa.timestamp != entry.timestamp):
+			return False
+		# Or the remote listing does not show it yet
+		self.picasa = entry
+		self.markSynced()
+		self.LOG.debug(u'Skipping photo "{}" because it was synced before the interruption'.format(self.title))
+		return True
+
 	@dryrun('self.album.cl_args.dry_run', LOG, u'Uploading file "{self.disk.path}"{reason}')
 	def upload(self):
-		if self.isInPicasa():
-			if self.album.cl_args.force_update and self.album.cl_args.force_update == 'metadata':
-				self.picasa.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
-				try:
-					self.picasa = self.album.client.UpdatePhotoMetadata(self.picasa)
-				except GooglePhotosException as e:
-					self.LOG.error(u'Error updating metadata for photo "{}": '.format(self.title) + str(e))
-				finally:
-					return
+		if self.isInPicasa() and self.album.cl_args.force_update == 'metadata':
+			if self.album.batch:
+				# The whole entries to update are fetched in batches too
+				self.album.batch.add(self.album.picasa.gphoto_id.text, BatchQueue.QUERY, self.picasa.uri, self.queriedMetadata)
+				return
+			try:
+				entry = self.picasaEntry()
+				entry.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
+				entry = self.album.client.UpdatePhotoMetadata(entry)
+			except (gdata.photos.service.GooglePhotosException, gdata.service.RequestError) as e:
+				self.updatedMetadata(None, str(e))
 			else:
-				metadata = self.picasa
-				metadata.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
-				metadata.title = atom.Title(text = self.title)
-		else:
-			metadata = gdata.photos.PhotoEntry()
-			metadata.title = atom.Title(text = self.title)
-			metadata.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
+				self.updatedMetadata(entry, None)
+			return
 
-		mimetype = mimetypes.guess_type(self.path)[0]
-		transforms = self.album.cl_args.transform[:] if self.album.cl_args.transform else None
-		if transforms:
-			original = pyexiv2.ImageMetadata(googlecl.safe_decode(self.path))
+		args = (self.path, self.album.cl_args.transform, self.album.cl_args.max_size, self.album.cl_args.strip_exif, self.isRaw(), AlbumList.standard_types, self.album.cl_args.transform_cache)
+		transformed = self.album.cl_args.transform or self.album.cl_args.strip_exif
+		# Only transformed photos are held in memory, so only they are charged, before the buffer is built
+		reserved = self.reserve() if transformed else 0
+		if self.album.pipeline and transformed:
+			self.album.pipeline.submit(self, args, reserved)
+			return
+		try:
+			(data, mimetype), seconds = timed_transform_photo(*args)
+		except TransformError as e:
+			self.release(reserved)
+			self.LOG.error(unicode(e))
+			return
+		except Exception:
+			self.release(reserved)
+			raise
+		# Untransformed photos only have their type guessed, which is not worth a transform sample
+		if transformed:
+			metrics.record('transform', seconds)
+		if data is not None and self.album.cl_args.transform_cache:
+			self.album.cl_args.transform_cache.added(len(data))
+		self.send(self.path if data is None else cStringIO.StringIO(data), mimetype, reserved)
+
+	def reserve(self):
+		"""Wait for room in the in-flight budget for the transformed photo, estimated by the size of its file."""
+		budget = self.album.cl_args.inflight_budget
+		if not budget:
+			return 0
+		try:
+			size = self.size()
+		except EnvironmentError:
+			size = 0
+		budget.acquire(size)
+		return size
+
+	def release(self, reserved):
+		if reserved:
+			self.album.cl_args.inflight_budget.release(reserved)
+
+	def queriedMetadata(self, entry, error):
+		if error:
+			self.updatedMetadata(None, error)
+			return
+		entry = gdata.photos.PhotoEntryFromString(entry.ToString())
+		# The batch id and status of the query are not sent back with the update
+		entry.extension_elements = [e for e in entry.extension_elements if e.namespace != gdata.BATCH_NAMESPACE]
+		entry.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
+		self.album.batch.add(self.album.picasa.gphoto_id.text, BatchQueue.UPDATE, entry, self.updatedMetadata)
+
+	def updatedMetadata(self, entry, error):
+		if error:
+			self.LOG.error(u'Error updating metadata for photo "{}": '.format(self.title) + error)
+			return
+		if not isinstance(entry, gdata.photos.PhotoEntry):
+			entry = gdata.photos.PhotoEntryFromString(entry.ToString())
+		self.picasa = PhotoPicasaEntry(entry)
+		self.markSynced()
+		self.journal('updated')
+		self.album.forgetCache()
+
+	def send(self, photo, mimetype, reserved = 0):
+		"""Upload photo, a path or a file object, releasing the in-flight bytes reserved for it once it is sent."""
+		if isinstance(photo, basestring):
+			# Not transformed after all, the file is streamed
+			self.release(reserved)
+			reserved = 0
+		if self.isInPicasa():
 			try:
-				original.read()
-			except Exception as e:
-				self.LOG.error(u'Error reading file "{}": '.format(self.disk.path) + str(e))
+				metadata = self.picasaEntry()
+			except (gdata.photos.service.GooglePhotosException, gdata.service.RequestError) as e:
+				self.LOG.error(u'Error uploading file "{}": '.format(self.disk.path) + str(e))
+				self.release(reserved)
+				if not isinstance(photo, basestring):
+					photo.close()
 				return
-
-			if 'raw' in transforms and not self.isRaw():
-				transforms.remove('raw')
-			if 'resize' in transforms and not (original.dimensions[0] > self.album.cl_args.max_size[0] or original.dimensions[1] > self.album.cl_args.max_size[1]):
-				transforms.remove('resize')
-			if 'rotate' in transforms and ('Exif.Image.Orientation' not in original or original['Exif.Image.Orientation'].value == 1):
-				transforms.remove('rotate')
-
-			if 'raw' in transforms:
-				if len(original.previews) == 0:
-					self.LOG.error(u'Error getting valid preview from raw file "{}"'.format(self.disk.path))
-					return
-				try:
-					preview = next(x for x in original.previews if (x.dimensions[0] >= self.album.cl_args.max_size[0] or x.dimensions[1] >= self.album.cl_args.max_size[1]) and x.mime_type in AlbumList.standard_types)
-				except StopIteration:
-					preview = metadata.previews[-1]
-				mimetype = preview.mime_type
-				if mimetype not in AlbumList.standard_types:
-					self.LOG.error(u'Error getting valid preview from raw file "{}"'.format(self.disk.path))
-					return
-				photo = cStringIO.StringIO(preview.data)
-			else:
-				photo = cStringIO.StringIO(original.buffer)
-#			if 'resize' in transforms or 'rotate' in transforms and mimetype != 'image/jpeg':
-			if 'resize' in transforms or 'rotate' in transforms:
-				image = Image.open(photo)
-				if 'resize' in transforms:
-					image.thumbnail(self.album.cl_args.max_size, Image.ANTIALIAS)
-				if 'rotate' in transforms:
-					for t in self.transforms.get(original['Exif.Image.Orientation'].value, ()):
-						image = image.transpose(t)
-					original['Exif.Image.Orientation'] = 1
-				photo = cStringIO.StringIO()
-				# TODO: save in the same format and size approx
-				image.save(photo, 'JPEG', quality = 95)
-				mimetype = 'image/jpeg'
-				photo.seek(0)
-#			if 'rotate' in transforms and 'resize' not in transforms and mimetype == 'image/jpeg':
-#				# TODO: lossless jpeg rotate
-#				pass
-			if not self.album.cl_args.strip_exif:
-				modified = pyexiv2.ImageMetadata.from_buffer(photo.getvalue())
-				modified.read()
-				original.copy(modified)
-				modified.write()
-				photo = cStringIO.StringIO(modified.buffer)
 		else:
-			if self.album.cl_args.strip_exif:
-				original = pyexiv2.ImageMetadata.from_buffer(file(self.path).read())
-				original.read()
-				for k in original.exif_keys + original.iptc_keys + original.xmp_keys:
-					del original[k]
-				del original.comment
-				original.write()
-				photo = cStringIO.StringIO(original.buffer)
-			else:
-				photo = self.path
+			metadata = gdata.photos.PhotoEntry()
+		metadata.title = atom.Title(text = self.title)
+		metadata.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
+		# Remember the local file in the remote entry so it can be recognized if it is moved to another album
 		try:
-			if self.isInPicasa():
-				metadata = self.album.client.UpdatePhotoMetadata(metadata)
-				self.picasa = self.album.client.UpdatePhotoBlob(metadata, photo, mimetype)
-			else:
-				self.picasa = self.album.client.InsertPhoto(self.album.picasa, metadata, photo, mimetype)
-		except GooglePhotosException as e:
+			metadata.checksum = gdata.photos.Checksum(text = self.fingerprint())
+		except EnvironmentError:
+			pass
+		# InsertPhoto and UpdatePhotoBlob read the whole photo into memory, so build the media source ourselves and
+		# let the HTTP layer stream it in chunks
+		if isinstance(photo, basestring):
+			photo = open(photo, 'rb')
+		photo.seek(0, os.SEEK_END)
+		length = photo.tell()
+		photo.seek(0)
+		media = gdata.MediaSource(file_handle = photo, content_type = mimetype, content_length = length, file_name = os.path.basename(self.path))
+		try:
+			with metrics.timer('upload'):
+				if self.isInPicasa():
+					metadata = self.album.client.UpdatePhotoMetadata(metadata)
+					entry = self.album.client.Put(None, metadata.GetEditMediaLink().href, media_source = media, converter = gdata.photos.PhotoEntryFromString)
+				else:
+					entry = self.album.client.Post(metadata, self.album.picasa.GetFeedLink().href, media_source = media, converter = gdata.photos.PhotoEntryFromString)
+				self.picasa = PhotoPicasaEntry(entry)
+		except (gdata.photos.service.GooglePhotosException, gdata.service.RequestError) as e:
 			self.LOG.error(u'Error uploading file "{}": '.format(self.disk.path) + str(e))
+		else:
+			metrics.count('bytes_uploaded', length)
+			self.markSynced()
+			self.journal('uploaded')
+			self.album.forgetCache()
+		finally:
+			self.release(reserved)
+			photo.close()
+
+	@dryrun('self.album.cl_args.dry_run', LOG, u'Moving photo "{self.moved_from.title}" from album "{self.moved_from.album.title}"{reason}')
+	def move(self):
+		try:
+			entry = self.moved_from.picasaEntry()
+			entry.albumid = gdata.photos.Albumid(text = self.album.picasa.gphoto_id.text)
+			entry.title = atom.Title(text = self.title)
+			entry.timestamp = gdata.photos.Timestamp(text = str(long(self.disk.timestamp) * 1000))
+			self.picasa = PhotoPicasaEntry(self.album.client.UpdatePhotoMetadata(entry))
+		except (gdata.photos.service.GooglePhotosException, gdata.service.RequestError) as e:
+			self.LOG.error(u'Error moving photo "{}" from album "{}": '.format(self.moved_from.title, self.moved_from.album.title) + str(e))
+		else:
+			# The vanished source keeps the same Picasa id, so it is forgotten before the new path is marked
+			if self.album.state:
+				self.album.state.forgetPicasa(self.picasa.id)
+			self.markSynced()
+			self.journal('moved')
+			self.album.forgetCache()
+			self.moved_from.album.forgetCache()
+			if self.album.moves:
+				self.album.moves.moved(self)
 
 	@dryrun('self.album.cl_args.dry_run', LOG, u'Downloading photo "{self.title}"{reason}')
 	def download(self):
-		timestamp = _entry_ts(self.picasa)
+		timestamp = self.picasa.timestamp
 		if not self.disk:
-			self.disk = PhotoDiskEntry(self.album.cl_args, self.title + mimetypes.guess_extension(self.picasa.content.type), self.album.disk.path)
+			self.disk = PhotoDiskEntry(self.album.cl_args, self.title + mimetypes.guess_extension(self.picasa.type), self.album.disk.path)
 		if mimetypes.guess_type(self.path)[0] in AlbumList.raw_types:
 			self.LOG.warn(u'Not overwriting RAW file "{}"'.format(self.path))
 			return
+		version = u'{} {} {}'.format(self.picasa.id, self.picasa.timestamp, self.picasa.size)
+		self.album.downloads.submit(self.picasa.src, self.path, functools.partial(self.downloaded, timestamp), version, self.picasa.size)
+
+	def downloaded(self, timestamp, error):
 		tmpfilename = self.path + '.part'
 		try:
-			urllib.urlretrieve(self.picasa.content.src, tmpfilename)
+			if error:
+				raise error
 			os.utime(tmpfilename, (timestamp, timestamp))
 			os.rename(tmpfilename, self.path)
 		except EnvironmentError as e:
 			self.LOG.error(u'Error downloading photo "{}": '.format(self.title) + str(e))
 		else:
 			self.disk.timestamp = timestamp
+			self.journal('downloaded')
+			# The timestamp of the new file depends on the origin, so let the next scan probe it again
+			if self.album.state:
+				self.album.state.forget(self.path)
 
 	@dryrun('self.album.cl_args.dry_run', LOG, u'Deleting file "{self.disk.path}"{reason}')
 	def deleteFromDisk(self):
 		try:
-			os.remove(self.path)
+			with metrics.timer('delete_local'):
+				os.remove(self.path)
 		except EnvironmentError as e:
 			self.LOG.error(u'Cannot delete local file: ' + str(e))
+		else:
+			if self.album.state:
+				self.album.state.forget(self.path)
 		finally:
 			self.disk = None
 
 	@dryrun('self.album.cl_args.dry_run', LOG, u'Deleting photo "{self.title}"{reason}')
 	def deleteFromPicasa(self):
 		try:
-			self.album.client.Delete(self.picasa)
-		except GooglePhotosException as e:
-			self.LOG.error(u'Error deleting photo "{}": '.format(self.title) + str(e))
+			callback = functools.partial(self.deletedFromPicasa, self.picasa.id)
+			if self.album.batch:
+				self.album.batch.add(self.album.picasa.gphoto_id.text, BatchQueue.DELETE, self.picasa.uri, callback)
+				return
+			try:
+				with metrics.timer('delete'):
+					self.album.client.Delete(self.picasa.edit)
+			except gdata.photos.service.GooglePhotosException as e:
+				callback(None, str(e))
+			else:
+				callback(None, None)
 		finally:
 			self.picasa = None
 
+	def deletedFromPicasa(self, picasa_id, entry, error):
+		if error:
+			self.LOG.error(u'Error deleting photo "{}": '.format(self.title) + error)
+		else:
+			# The local file is already gone, so only its Picasa id still names it in the state database
+			if self.album.state:
+				self.album.state.forgetPicasa(picasa_id)
+			self.album.forgetCache()
+
 	def sync(self):
+		if self.isResumed():
+			return
 		if self.isInDisk() and not self.isInPicasa():
-			if self.album.cl_args.upload:
-				self.upload(reason = u' because it is not in the album "{0.title}"'.format(self.album))
+			if self.album.cl_args.upload and self.moved_from:
+				self.act('move', u' because it is not in the album "{0.title}"'.format(self.album))
+			elif self.album.cl_args.upload:
+				self.act('upload', u' because it is not in the album "{0.title}"'.format(self.album))
 			if self.album.cl_args.download and self.album.cl_args.delete_photos:
-				self.deleteFromDisk(reason = u' because it is not in the album "{0.title}"'.format(self.album))
+				self.act('deleteFromDisk', u' because it is not in the album "{0.title}"'.format(self.album))
 		elif self.isInPicasa() and not self.isInDisk():
 			if self.album.cl_args.upload and self.album.cl_args.delete_photos:
-				self.deleteFromPicasa(reason = ' because it does not exist in the local album')
+				self.act('deleteFromPicasa', ' because it does not exist in the local album')
 			if self.album.cl_args.download:
-				self.download(reason = ' because it does not exist in the local album')
+				self.act('download', ' because it does not exist in the local album')
 		elif self.album.cl_args.update:
-			if self.album.cl_args.upload and (self.disk.timestamp > _entry_ts(self.picasa) or self.album.cl_args.force_update):
-				self.upload(reason = u' {0}because it is newer than the one in the album "{1.title}"'.format('[FORCED] ' if self.album.cl_args.force_update else '', self.album))
-			if self.album.cl_args.download and (self.disk.timestamp < _entry_ts(self.picasa) or self.album.cl_args.force_update):
-				self.download(reason = u' {0}because it is newer than the one in the album "{1.title}"'.format('[FORCED] ' if self.album.cl_args.force_update else '', self.album))
+			if not self.album.cl_args.force_update and self.isSynced():
+				return
+			if self.disk.timestamp == self.picasa.timestamp:
+				self.markSynced()
+			if self.album.cl_args.upload and (self.disk.timestamp > self.picasa.timestamp or self.album.cl_args.force_update):
+				self.act('upload', u' {0}because it is newer than the one in the album "{1.title}"'.format('[FORCED] ' if self.album.cl_args.force_update else '', self.album))
+			if self.album.cl_args.download and (self.disk.timestamp < self.picasa.timestamp or self.album.cl_args.force_update):
+				self.act('download', u' {0}because it is newer than the one in the album "{1.title}"'.format('[FORCED] ' if self.album.cl_args.force_update else '', self.album))
 
 class Album(dict):
 	LOG = logging.getLogger('Album')
 
 	def __init__(self, cl_args, title = None, disk = None, picasa = None):
-		self.client = None
+		self.executor = None
+		self.pipeline = None
+		self.downloads = None
+		self.batch = None
+		self.moves = None
+		self.plan = None
+		self.journal = None
+		self.state = None
+		self.tasks = None
 		self.cl_args = cl_args
 		self.disk = disk
 		self.picasa = picasa
@@ -325,6 +587,45 @@ class Album(dict):
 		self.filled_from_disk = False
 		self.filled_from_picasa = False
 
+	@apply
+	def client():
+		def fget(self):
+			return self.executor.client
+		return property(**locals())
+
+	@classmethod
+	def restore(cls, cl_args, description):
+		"""Build an album from a plan. It is not filled from disk or Picasa, only its planned photos are synced."""
+		disk = description['disk'] and AlbumDiskEntry.restore(description['disk']['path'], description['disk']['timestamp'])
+		picasa = description['picasa'] and gdata.photos.AlbumEntryFromString(description['picasa'].encode('utf-8'))
+		album = cls(cl_args, description['title'], disk = disk, picasa = picasa)
+		album.filled_from_disk = True
+		album.filled_from_picasa = True
+		return album
+
+	def describe(self):
+		return {
+			'title': self.title,
+			'disk': self.disk and {'path': self.disk.path, 'timestamp': self.disk.timestamp},
+			'picasa': self.picasa and self.picasa.ToString(),
+		}
+
+	def act(self, op, reason, *args):
+		"""Run the operation op, or add it and the operations on its photos to the plan when planning."""
+		if not self.plan:
+			getattr(self, op)(*args, reason = reason)
+			return
+		self.plan.addAlbum(self)
+		self.plan.add({'kind': 'album', 'op': op, 'album': self.title, 'photo': None, 'reason': reason, 'bytes': 0, 'root': args[0] if args else None})
+		if op == 'download':
+			self.fillFromPicasa()
+		for photo_title in sorted(self.iterkeys()):
+			photo = self[photo_title]
+			if op == 'upload':
+				photo.sync()
+			elif op in ('download', 'deleteFromDisk'):
+				photo.act(op, reason)
+
 	def combine(self, other):
 		if self.isInDisk() and not other.isInDisk() and other.isInPicasa():
 			self.picasa = other.picasa
@@ -337,27 +638,56 @@ class Album(dict):
 		if self.filled_from_disk:
 			return
 
+		try:
+			mtime = os.stat(self.disk.path).st_mtime
+		except EnvironmentError:
+			mtime = None
 		for f in files:
 			raw = mimetypes.guess_type(f)[0] in AlbumList.raw_types
-			photo = Photo(self, disk = PhotoDiskEntry(self.cl_args, f, self.disk.path), raw = raw)
+			photo = Photo(self, disk = PhotoDiskEntry(self.cl_args, f, self.disk.path, self.state), raw = raw)
+			if photo.disk.mtime is not None:
+				mtime = max(mtime, photo.disk.mtime)
+			else:
+				try:
+					mtime = max(mtime, os.stat(photo.path).st_mtime)
+				except EnvironmentError:
+					pass
 			if photo.title in self:
 				self[photo.title].combine(photo)
 			else:
 				self[photo.title] = photo
+		self.disk.mtime = mtime
 		self.filled_from_disk = True
 
 	def fillFromPicasa(self):
 		if self.filled_from_picasa:
 			return
 
-		for photo_entry in self.client.GetEntries('/data/feed/api/user/default/albumid/%s?kind=photo' % self.picasa.gphoto_id.text):
-			if mimetypes.guess_type(photo_entry.title.text)[0] in AlbumList.standard_types.union(AlbumList.raw_types):
-				photo_entry.title = atom.Title(text = os.path.splitext(photo_entry.title.text)[0])
-			photo = Photo(self, picasa = photo_entry)
-			if photo.title in self:
-				self[photo.title].combine(photo)
-			else:
-				self[photo.title] = photo
+		with metrics.timer('album_list'):
+			photo_entries = None
+			if self.state:
+				cached = self.state.cachedAlbum(self.picasa.gphoto_id.text, self.picasa.updated.text)
+				if cached is not None:
+					self.LOG.debug(u'Using cached photo list for album "{}"'.format(self.title))
+					try:
+						photo_entries = [PhotoPicasaEntry.restore(json.loads(entry)) for entry in cached]
+					except (ValueError, KeyError):
+						# Cached by an older version as XML
+						photo_entries = None
+			if photo_entries is None:
+				# Keep only the fields needed, instead of every parsed entry, as soon as the feed is read
+				photo_entries = [PhotoPicasaEntry(entry) for entry in self.client.GetEntries('/data/feed/api/user/default/albumid/%s?kind=photo' % self.picasa.gphoto_id.text)]
+				if self.state:
+					self.state.storeAlbum(self.picasa.gphoto_id.text, self.picasa.updated.text, [json.dumps(entry.describe()) for entry in photo_entries])
+
+			for photo_entry in photo_entries:
+				if mimetypes.guess_type(photo_entry.title)[0] in AlbumList.standard_types.union(AlbumList.raw_types):
+					photo_entry.title = os.path.splitext(photo_entry.title)[0]
+				photo = Photo(self, picasa = photo_entry)
+				if photo.title in self:
+					self[photo.title].combine(photo)
+				else:
+					self[photo.title] = photo
 		self.filled_from_picasa = True
 
 	def isInDisk(self):
@@ -366,17 +696,36 @@ class Album(dict):
 	def isInPicasa(self):
 		return bool(self.picasa)
 
+	def changedSince(self, since):
+		if not self.isInDisk() or not self.isInPicasa():
+			return True
+		if _entry_updated(self.picasa) >= since:
+			return True
+		# Photos edited in place do not change the directory
+		return self.disk.mtime is None or self.disk.mtime >= since
+
+	def forgetCache(self):
+		if self.state and self.isInPicasa():
+			self.state.forgetAlbum(self.picasa.gphoto_id.text)
+
 	@dryrun('self.cl_args.dry_run', LOG, u'Creating album "{self.title}"{reason}')
 	def upload(self):
 		access = googlecl.picasa._map_access_string(self.client.config.lazy_get(picasa.SECTION_HEADER, 'access'))
+		entry = self.journal and self.journal.album(self.title)
 		try:
-			self.picasa = self.client.InsertAlbum(title = self.title, summary = None, access = access, timestamp = str(long(self.disk.timestamp) * 1000))
-		except GooglePhotosException as e:
+			if entry:
+				# Created before the interruption, but not in the remote listing yet
+				self.picasa = gdata.photos.AlbumEntryFromString(entry.encode('utf-8'))
+			else:
+				self.picasa = self.client.InsertAlbum(title = self.title, summary = None, access = access, timestamp = str(long(self.disk.timestamp) * 1000))
+				if self.journal:
+					self.journal.albumCreated(self.title, self.picasa.ToString())
+		except gdata.photos.service.GooglePhotosException as e:
 			self.LOG.error(u'Error creating album "{}": '.format(self.title) + str(e))
 		else:
 			for photo_title in sorted(self.iterkeys()):
 				photo = self[photo_title]
-				photo.upload()
+				self.submit(photo.sync)
 
 	@dryrun('self.cl_args.dry_run', LOG, u'Creating directory "{self.title}"{reason}')
 	def download(self, root):
@@ -394,7 +743,7 @@ class Album(dict):
 		self.fillFromPicasa()
 		for photo_title in sorted(self.iterkeys()):
 			photo = self[photo_title]
-			photo.download()
+			self.submit(photo.download)
 
 	@dryrun('self.cl_args.dry_run', LOG, u'Deleting directory "{self.disk.path}"{reason}')
 	def deleteFromDisk(self):
@@ -413,49 +762,86 @@ class Album(dict):
 	def deleteFromPicasa(self):
 		try:
 			self.client.Delete(self.picasa)
-		except GooglePhotosException as e:
+		except gdata.photos.service.GooglePhotosException as e:
 			self.LOG.error(u'Error deleting album "{}": '.format(self.title) + str(e))
+		else:
+			self.forgetCache()
 		finally:
 			self.picasa = None
 	
+	def submit(self, task):
+		"""Queue a photo task, counted in the tasks of the album while it is being synced."""
+		self.executor.submit(self.tasks.wrap(task) if self.tasks else task)
+
+	def synced(self, start):
+		"""Called once the last photo task of the album has finished."""
+		# Send the operations left in a partial batch now, instead of keeping them until every album is done
+		if self.batch and self.isInPicasa():
+			self.batch.flush(self.picasa.gphoto_id.text)
+		# With several threads sync() only queues the photo tasks, so the album is timed until the last one ends
+		metrics.record('album_sync', time.time() - start)
+
 	def sync(self):
 		root = self.cl_args.paths[0]
-
-		if self.isInDisk() and not self.isInPicasa():
-			if self.cl_args.upload:
-				self.upload(reason = u' because it does not exist in Picasa')
-			if self.cl_args.download and self.cl_args.delete_albums:
-				self.deleteFromDisk(reason = u' because it does not exist in Picasa')
-		elif self.isInPicasa() and not self.isInDisk():
-			if self.cl_args.upload and self.cl_args.delete_albums:
-				self.deleteFromPicasa(reason = u' because it does not exist locally')
-			if self.cl_args.download:
-				self.download(root, reason = u' because it does not exist locally')
-		else:
-			self.LOG.debug(u'Checking album "{}"...'.format(self.title))
-			self.fillFromPicasa()
-			for photo_title in sorted(self.iterkeys()):
-				photo = self[photo_title]
-				photo.sync()
+		self.tasks = TaskGroup(functools.partial(self.synced, time.time()))
+		try:
+			if self.isInDisk() and not self.isInPicasa():
+				if self.cl_args.upload:
+					self.act('upload', u' because it does not exist in Picasa')
+				if self.cl_args.download and self.cl_args.delete_albums:
+					self.act('deleteFromDisk', u' because it does not exist in Picasa')
+			elif self.isInPicasa() and not self.isInDisk():
+				if self.cl_args.upload and self.cl_args.delete_albums:
+					self.act('deleteFromPicasa', u' because it does not exist locally')
+				if self.cl_args.download:
+					self.act('download', u' because it does not exist locally', root)
+			else:
+				self.LOG.debug(u'Checking album "{}"...'.format(self.title))
+				self.fillFromPicasa()
+				for photo_title in sorted(self.iterkeys()):
+					photo = self[photo_title]
+					self.submit(photo.sync)
+		finally:
+			tasks, self.tasks = self.tasks, None
+			tasks.close()
 
 class AlbumList(dict):
 	LOG = logging.getLogger('AlbumList')
+	PENDING_PER_THREAD = 4
 	standard_types = set(['image/jpeg', 'image/x-ms-bmp', 'image/gif', 'image/png'])
 	raw_types = set(['image/x-nikon-nef'])
 
-	def __init__(self, clients, cl_args):
+	def __init__(self, clients, cl_args, state = None, pipeline = None, plan = None, journal = None):
 		self.clients = clients
 		self.cl_args = cl_args
+		self.state = state
+		self.pipeline = pipeline
+		self.plan = plan
+		self.journal = journal
+		self.executor = WorkQueue(clients, cl_args.threads)
+		self.pending = cl_args.threads * self.PENDING_PER_THREAD
+		self.downloads = DownloadEngine(cl_args.download_workers)
+		self.batch = BatchQueue(clients, cl_args.batch_size) if cl_args.batch_size > 1 else None
+		self.moves = MoveIndex() if cl_args.detect_moves else None
 		self.supported_types = self.standard_types
 		if self.cl_args.transform and 'raw' in self.cl_args.transform:
 			self.supported_types = self.supported_types.union(self.raw_types)
 		self.filled_from_disk = False
 		self.filled_from_picasa = False
 
-	def fillFromDisk(self):
-		if self.filled_from_disk:
-			return
-
+	def attach(self, album):
+		album.state = self.state
+		album.executor = self.executor
+		album.pipeline = self.pipeline
+		album.downloads = self.downloads
+		album.batch = self.batch
+		album.moves = self.moves
+		album.plan = self.plan
+		album.journal = self.journal
+		return album
+
+	def walkDisk(self):
+		titles = set()
 		for path in self.cl_args.paths:
 			for root, dirs, files in os.walk(path):
 				supported_files = sorted([f for f in files if mimetypes.guess_type(f)[0] in self.supported_types])
@@ -463,7 +849,7 @@ class AlbumList(dict):
 					continue
 				if root == path:
 					album_title = os.path.basename(os.path.normpath(root))
-				elif len(self.cl_args.paths) > 1 or googlecl.safe_decode(os.path.basename(os.path.normpath(path))) in self:
+				elif len(self.cl_args.paths) > 1 or googlecl.safe_decode(os.path.basename(os.path.normpath(path))) in titles:
 					album_title = os.path.join(os.path.basename(os.path.normpath(path)), os.path.relpath(root, path))
 				else:
 					album_title = os.path.relpath(root, path)
@@ -473,54 +859,275 @@ class AlbumList(dict):
 					if num_albums > 1:
 						self.LOG.debug(u'Splicing album "{} ({})" with photos from "{}" to "{}"'.format(album_title, i + 1, supported_files[i * self.cl_args.max_photos], supported_files[min(i * self.cl_args.max_photos + self.cl_args.max_photos - 1, len(supported_files) - 1)]))
 						full_album_title = album_title + ' (%s)' % (i + 1)
-					album = Album(self.cl_args, full_album_title, disk = AlbumDiskEntry(self.cl_args, root))
-					album.fillFromDisk(supported_files[i * self.cl_args.max_photos:i * self.cl_args.max_photos + self.cl_args.max_photos])
-					if album.title in self:
-						self[album.title].combine(album)
-					else:
-						self[album.title] = album
+					album = self.attach(Album(self.cl_args, full_album_title, disk = AlbumDiskEntry(self.cl_args, root)))
+					if album.title in titles:
+						raise InvalidArguments(u'Tried to combine the album "{}" with another of the same type'.format(album.title))
+					titles.add(album.title)
+					yield album, supported_files[i * self.cl_args.max_photos:i * self.cl_args.max_photos + self.cl_args.max_photos]
+
+	def scanAlbum(self, album, files):
+		try:
+			with metrics.timer('album_scan'):
+				album.fillFromDisk(files)
+		except Exception:
+			return None, sys.exc_info()
+		return album, None
+
+	def scanDisk(self):
+		"""Yield the local albums, filled from disk, as soon as their photos have been probed.
+
+		The directories are walked in this thread while a pool of threads probes the photos of each album.
+		"""
+		pool = multiprocessing.pool.ThreadPool(self.cl_args.scan_workers)
+		results = Queue.Queue()
+		pending = 0
+		try:
+			for album, files in self.walkDisk():
+				pool.apply_async(self.scanAlbum, (album, files), callback = results.put)
+				pending += 1
+				while not results.empty() or pending > self.cl_args.scan_workers * 2:
+					pending -= 1
+					yield self.scanned(results)
+			while pending:
+				pending -= 1
+				yield self.scanned(results)
+		finally:
+			pool.terminate()
+
+	def scanned(self, results):
+		# Wait with a timeout so the main thread stays interruptible
+		while True:
+			try:
+				album, error = results.get(timeout = 0.5)
+				break
+			except Queue.Empty:
+				pass
+		if error:
+			raise error[0], error[1], error[2]
+		return album
+
+	def fillFromDisk(self):
+		if self.filled_from_disk:
+			return
+
+		with metrics.timer('fill_from_disk'):
+			for album in self.scanDisk():
+				if album.title in self:
+					self[album.title].combine(album)
+				else:
+					self[album.title] = album
 		self.filled_from_disk = True
 
 	def fillFromPicasa(self):
 		if self.filled_from_picasa:
 			return
 
-		for album_entry in self.clients[0].GetEntries('/data/feed/api/user/default?kind=album'):
-			album = Album(self.cl_args, picasa = album_entry)
-			if album.title in self:
-				self[album.title].combine(album)
-			else:
-				self[album.title] = album
+		with metrics.timer('fill_from_picasa'):
+			with self.clients.checkout() as client:
+				album_entries = client.GetEntries('/data/feed/api/user/default?kind=album')
+			for album_entry in album_entries:
+				album = self.attach(Album(self.cl_args, picasa = album_entry))
+				if album.title in self:
+					self[album.title].combine(album)
+				else:
+					self[album.title] = album
 		self.filled_from_picasa = True
 
-	def sync(self):
+	def listPicasa(self):
+		try:
+			self.fillFromPicasa()
+		except Exception:
+			self.remote_error = sys.exc_info()
+
+	def submit(self, album):
+		if self.cl_args.since and not album.changedSince(self.cl_args.since):
+			self.LOG.debug(u'Skipping album "{}" because it has not changed'.format(album.title))
+			return
+		self.executor.submit(album.sync, priority = WorkQueue.ALBUM_PRIORITY)
+
+	def syncWithMoves(self):
+		# Moves can only be found knowing every album on both sides, so nothing is streamed here
 		self.fillFromDisk()
 		self.fillFromPicasa()
-		if self.cl_args.threads == 1:
-			for album_title in sorted(self.iterkeys()):
-				album = self[album_title]
-				album.client = self.clients[0]
-				album.sync()
-				del self[album_title]
-		else:
-			threads = []
-			clients = self.clients[:]
-			for album_title in sorted(self.iterkeys()):
-				album = self[album_title]
-				if len(threads) == self.cl_args.threads:
-					for i in itertools.cycle(xrange(len(threads))):
-						threads[i][0].join(0.1)
-						if not threads[i][0].is_alive():
-							clients.append(threads[i][1].client)
-							del self[album_title]
-							del threads[i]
-							break
-				album.client = clients.pop()
-				new_thread = threading.Thread(target = album.sync)
-				new_thread.start()
-				threads.append((new_thread, album))
-			for (thread, album) in threads:
-				thread.join()
+		for album_title in sorted(self.iterkeys()):
+			album = self[album_title]
+			if album.isInPicasa():
+				with self.clients.checkout():
+					album.fillFromPicasa()
+		self.moves.plan(self.itervalues())
+		# Albums deleted from Picasa may hold photos that are being moved elsewhere, so delete them last
+		deleted = []
+		for album_title in sorted(self.keys()):
+			album = self.pop(album_title)
+			if album.isInPicasa() and not album.isInDisk():
+				deleted.append(album)
+			else:
+				self.submit(album)
+		self.executor.wait()
+		for album in deleted:
+			self.submit(album)
+
+	def sync(self):
+		if self.moves:
+			self.syncWithMoves()
+			self.finish()
+			return
+
+		# List the remote albums while the local tree is being scanned, and start syncing each local album as soon as
+		# both sides are known. The next album is only taken once the queued tasks have gone down to a few per thread,
+		# which also holds back the scan, so only the albums being synced are in memory and each one is released when
+		# its last photo is done.
+		self.remote_error = None
+		remote = threading.Thread(target = self.listPicasa)
+		remote.daemon = True
+		remote.start()
+		for album in self.scanDisk():
+			while remote.is_alive():
+				remote.join(0.5)
+			if self.remote_error:
+				raise self.remote_error[0], self.remote_error[1], self.remote_error[2]
+			if album.title in self:
+				album.combine(self.pop(album.title))
+			self.executor.wait(self.pending)
+			self.submit(album)
+		while remote.is_alive():
+			remote.join(0.5)
+		if self.remote_error:
+			raise self.remote_error[0], self.remote_error[1], self.remote_error[2]
+		for album_title in sorted(self.keys()):
+			self.executor.wait(self.pending)
+			self.submit(self.pop(album_title))
+		self.finish()
+
+	def executePlan(self, path):
+		"""Run the actions of a plan written with --plan, without scanning the disk or listing Picasa.
+
+		Albums are created first and deleted last. The photos in between are sent biggest first, so the slow
+		transfers start early and the small ones fill the gaps at the end.
+		"""
+		descriptions = {}
+		albums = {}
+		def album(title):
+			if title not in albums:
+				albums[title] = self.attach(Album.restore(self.cl_args, descriptions[title]))
+			return albums[title]
+
+		created, photos, deleted = [], [], []
+		for action in read_plan(path):
+			if action['kind'] == 'album_entry':
+				descriptions[action['title']] = action['entry']
+			elif action['kind'] == 'album':
+				target = album(action['album'])
+				args = (action['root'],) if action['root'] else ()
+				(created if action['op'] in ('upload', 'download') else deleted).append((target, action, args))
+			else:
+				target = Photo.restore(album(action['album']), action['entry'])
+				if action['op'] == 'move':
+					target.moved_from = Photo.restore(album(action['moved_from_album']), action['moved_from'])
+				photos.append((target, action, ()))
+		photos.sort(key = lambda (target, action, args): action['bytes'], reverse = True)
+		self.LOG.info('Executing plan "{}": {} album and {} photo operations, {:.1f} MB'.format(path, len(created) + len(deleted), len(photos), sum(action['bytes'] for (target, action, args) in photos) / 1048576.0))
+
+		for phase in (created, photos, deleted):
+			for target, action, args in phase:
+				if action['kind'] == 'photo' and not (target.album.isInDisk() if action['op'] in ('download', 'deleteFromDisk') else target.album.isInPicasa()):
+					self.LOG.error(u'Skipping photo "{}" because the album "{}" could not be created'.format(target.title, target.album.title))
+					continue
+				self.executor.submit(target.act, action['op'], action['reason'], *args)
+			self.executor.wait()
+		self.finish()
+
+	def status(self):
+		"""Report the local photos that changed since they were last synced, comparing them only with the state
+		database, and return how many there are."""
+		synced = self.state.synced()
+		seen = set()
+		new = modified = deleted = 0
+		for album, files in self.walkDisk():
+			for f in files:
+				f = googlecl.safe_decode(f)
+				path = os.path.abspath(os.path.join(album.disk.path, f))
+				seen.add(path)
+				try:
+					st = os.stat(path)
+				except EnvironmentError:
+					continue
+				record = self.state.lookup(path, st, self.cl_args.origin)
+				if record and record.picasa_id and record.picasa_timestamp == record.timestamp:
+					continue
+				if path in synced:
+					self.LOG.info(u'Modified "{}" in album "{}"'.format(f, album.title))
+					modified += 1
+				else:
+					self.LOG.info(u'New "{}" in album "{}"'.format(f, album.title))
+					new += 1
+		roots = [os.path.abspath(googlecl.safe_decode(root)) + os.sep for root in self.cl_args.paths]
+		for path in sorted(synced - seen):
+			if any(path.startswith(root) for root in roots) and not os.path.exists(path):
+				self.LOG.info(u'Deleted "{}"'.format(path))
+				deleted += 1
+		self.LOG.warn('{} new, {} modified and {} deleted photos to sync'.format(new, modified, deleted))
+		return new + modified + deleted
+
+	def finish(self):
+		self.executor.join()
+		if self.pipeline:
+			self.pipeline.join()
+		self.downloads.join()
+		if self.batch:
+			self.batch.flush()
+		if self.moves:
+			self.moves.summary()
+
+class MoveIndex(object):
+	"""Match local photos missing from Picasa with remote photos missing locally, so they can be moved instead of
+	uploaded again.
+
+	Remote photos are recognized by the fingerprint stored in their checksum on upload, or else by their title and
+	size.
+	"""
+	LOG = logging.getLogger('MoveIndex')
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.count = 0
+		self.bytes = 0
+
+	def plan(self, albums):
+		albums = list(albums)
+		by_checksum = {}
+		by_title = {}
+		for album in albums:
+			for photo in album.itervalues():
+				if photo.isInPicasa() and not photo.isInDisk():
+					if photo.picasa.checksum:
+						by_checksum.setdefault(photo.picasa.checksum, photo)
+					if photo.picasa.size:
+						by_title.setdefault((photo.title, photo.picasa.size), photo)
+		claimed = set()
+		for album in albums:
+			for photo in album.values():
+				if not photo.isInDisk() or photo.isInPicasa():
+					continue
+				try:
+					source = by_checksum.get(photo.fingerprint()) or by_title.get((photo.title, photo.size()))
+				except EnvironmentError:
+					continue
+				if not source or id(source) in claimed:
+					continue
+				claimed.add(id(source))
+				photo.moved_from = source
+				# The source is not synced by its album anymore, so it is neither deleted nor downloaded
+				del source.album[source.title]
+				self.LOG.debug(u'Photo "{}" in album "{}" is "{}" in album "{}"'.format(photo.title, album.title, source.title, source.album.title))
+
+	def moved(self, photo):
+		with self.lock:
+			self.count += 1
+			self.bytes += photo.size()
+
+	def summary(self):
+		self.LOG.info('Moved {} photos instead of uploading them, saving {:.1f} MB'.format(self.count, self.bytes / 1048576.0))
 
 class ListParser:
 	def __init__(self, unique = True, type = str, nargs = None, separator = ',', choices = None):
@@ -565,30 +1172,163 @@ class StreamLogger(object):
 class PicasaSync(object):
 	MAX_PHOTOS_PER_ALBUM = 1000
 	MAX_PHOTO_SIZE = [2048, 2048]
+	TRANSFORM_CACHE_SIZE = 1024
+	BATCH_SIZE = 50
+	REQUEST_RATE = 10
+	RETRIES = 5
+	# Options changing the operations of a plan, which must be the same when it is executed
+	PLAN_OPTIONS = ('force_update', 'transform', 'max_size', 'strip_exif')
 	LOG = logging.getLogger('PicasaSync')
 
 	def __init__(self):
 		self.ncores = multiprocessing.cpu_count()
 		self.parse_cl_args()
-		self.get_picasa_client()
-		if len(self.clients) == 0:
-			raise Exception('Could not init application')
+		_init_mimetypes()
+		self.load_modules()
+		self.requests = RequestLayer(self.cl_args.request_rate, self.cl_args.retries)
+		self.config = None
+		self.token_lock = threading.Lock()
+		self.authenticated = False
+		self.token = None
+		self.clients = ClientPool(self.get_picasa_client, self.cl_args.clients)
+
+	def load_modules(self):
+		"""Import the modules the chosen mode needs now, so a missing one stops the program before any thread starts."""
+		modules = []
+		if not self.cl_args.status:
+			if not self.cl_args.verify_state:
+				modules += [googlecl, picasa, picasa_service, atom, gdata, dateutil]
+			if 'exif' in self.cl_args.origin:
+				modules.append(pyexiv2)
+			if self.cl_args.transform or self.cl_args.strip_exif:
+				modules += [pyexiv2, Image]
+		for module in modules:
+			module.load()
 
 	def get_picasa_client(self):
-		config = googlecl.config.load_configuration()
-		self.clients = []
-		for i in xrange(self.cl_args.threads):
-			client = picasa_service.SERVICE_CLASS(config)
-			client.debug = self.cl_args.debug
-			client.email = config.lazy_get(picasa.SECTION_HEADER, 'user')
-			auth_manager = googlecl.authentication.AuthenticationManager('picasa', client)
-			set_token = auth_manager.set_access_token()
-			if not set_token:
-				self.LOG.error('Error using OAuth token. You have to authenticate with googlecl using "google picasa list-albums --force-auth" and following the instructions')
-			self.clients.append(client)
+		# Subclasses the atom HTTP client, so it is only imported with the first client
+		from keepalive import KeepAliveHttpClient
+		with self.token_lock:
+			if self.config is None:
+				self.config = googlecl.config.load_configuration()
+		client = picasa_service.SERVICE_CLASS(self.config)
+		client.debug = self.cl_args.debug
+		client.http_client = KeepAliveHttpClient()
+		self.requests.wrap(client)
+		if self.cl_args.server:
+			server = urlparse.urlsplit(self.cl_args.server)
+			client.server = server.netloc
+			client.ssl = server.scheme == 'https'
+		client.email = self.config.lazy_get(picasa.SECTION_HEADER, 'user')
+		# Only the first client reads the OAuth token, the others share it
+		with self.token_lock:
+			if not self.authenticated:
+				auth_manager = googlecl.authentication.AuthenticationManager('picasa', client)
+				if not auth_manager.set_access_token():
+					self.LOG.error('Error using OAuth token. You have to authenticate with googlecl using "google picasa list-albums --force-auth" and following the instructions')
+				self.token = client.current_token
+				self.authenticated = True
+			else:
+				client.current_token = self.token
+		self.LOG.debug('Created Picasa client')
+		return client
+
+	def open_state(self):
+		if self.cl_args.no_state_db or not (self.cl_args.state_db or self.cl_args.paths):
+			return None
+		path = self.cl_args.state_db or os.path.join(self.cl_args.paths[0], StateDB.FILENAME)
+		try:
+			state = StateDB(path)
+		except sqlite3.Error as e:
+			self.LOG.warn(u'Cannot open state database "{}", continuing without it: '.format(path) + str(e))
+			return None
+		if self.cl_args.rebuild_state:
+			self.LOG.info('Rebuilding state database')
+			state.clear()
+		return state
+
+	def open_journal(self):
+		if self.cl_args.dry_run or self.cl_args.plan or self.cl_args.verify_state or self.cl_args.status:
+			return None
+		if not self.cl_args.journal and not self.cl_args.paths:
+			return None
+		path = self.cl_args.journal or os.path.join(self.cl_args.paths[0], Journal.FILENAME)
+		try:
+			return Journal(path, self.cl_args.resume)
+		except EnvironmentError as e:
+			self.LOG.warn(u'Cannot open journal "{}", continuing without it: '.format(path) + str(e))
+			return None
+
+	def verify_state(self, state):
+		def probe(path):
+			return PhotoDiskEntry(self.cl_args, os.path.basename(path), os.path.dirname(path)).timestamp
+		checked, stale, wrong = state.verify(self.cl_args.origin, probe)
+		self.LOG.warn('Verified {} state entries: {} stale, {} wrong'.format(checked, stale, wrong))
+
+	def current_plan_options(self):
+		# Through JSON, so they compare equal to the ones read from a plan
+		return json.loads(json.dumps(dict((name, getattr(self.cl_args, name)) for name in self.PLAN_OPTIONS)))
+
+	def check_plan(self, path):
+		try:
+			options = plan_options(path)
+		except (EnvironmentError, ValueError) as e:
+			self.LOG.error(u'Cannot read plan "{}": '.format(path) + str(e))
+			return False
+		if options != self.current_plan_options():
+			self.LOG.error(u'The plan "{}" was written with other options ({}), execute it with the same ones'.format(path,
+				', '.join('--' + name.replace('_', '-') for name in self.PLAN_OPTIONS)))
+			return False
+		return True
 
 	def sync(self):
-		AlbumList(self.clients, self.cl_args).sync()
+		profiler = Profiler(self.cl_args.profile).start() if self.cl_args.profile else None
+		state = self.open_state()
+		pipeline = None
+		plan = None
+		journal = self.open_journal()
+		finished = False
+		try:
+			if self.cl_args.verify_state:
+				if state:
+					self.verify_state(state)
+				return
+			if self.cl_args.status:
+				if not state:
+					self.LOG.error('The local state database is needed to show the status')
+					return 2
+				return 1 if AlbumList(self.clients, self.cl_args, state).status() else 0
+			if self.cl_args.plan:
+				plan = PlanWriter(self.cl_args.plan, self.current_plan_options())
+				AlbumList(self.clients, self.cl_args, state, plan = plan).sync()
+				self.LOG.warn('Wrote {} operations to plan "{}", {:.1f} MB to transfer'.format(plan.count, self.cl_args.plan, plan.bytes / 1048576.0))
+				return
+			if self.cl_args.execute and not self.check_plan(self.cl_args.execute):
+				return 2
+			# Fork the transform workers before any other thread is started
+			if self.cl_args.transform_workers:
+				pipeline = TransformPipeline(self.clients, self.cl_args.transform_workers, self.cl_args.upload_workers)
+			albums = AlbumList(self.clients, self.cl_args, state, pipeline, journal = journal)
+			if self.cl_args.execute:
+				albums.executePlan(self.cl_args.execute)
+			else:
+				albums.sync()
+			finished = True
+		finally:
+			self.requests.summary()
+			metrics.summary()
+			if self.cl_args.metrics:
+				metrics.dump(self.cl_args.metrics)
+			if profiler:
+				profiler.stop()
+			if journal:
+				journal.close(finished)
+			if plan:
+				plan.close()
+			if pipeline:
+				pipeline.close()
+			if state:
+				state.close()
 
 	def parse_cl_args(self):
 		parser = argparse.ArgumentParser(description = 'Sync one or more directories with your Picasa Web account. If only one directory is given and it doesn\'t contain any supported file, it is assumed to be the parent of all the local albums.')
@@ -599,19 +1339,49 @@ class PicasaSync(object):
 		parser.add_argument('-u', '--upload', dest = 'upload', action = 'store_true', help = 'Upload missing remote photos')
 		parser.add_argument('-d', '--download', dest = 'download', action = 'store_true', help = 'Download missing local photos')
 		parser.add_argument('-r', '--update', dest = 'update', action = 'store_true', help = 'Update changed local or remote photos')
-		parser.add_argument('-t', '--threads', dest = 'threads', type = int, nargs = '?', const = self.ncores, default = 1, help = 'Multithreaded operation. Set number of threads to use on album processing. If not given defaults to 1, if given without argument, defaults to number of CPU cores ({} in this system).'.format(self.ncores))
+		parser.add_argument('-t', '--threads', dest = 'threads', type = int, nargs = '?', const = self.ncores, default = 1, help = 'Multithreaded operation. Set number of threads to use on photo processing. If not given defaults to 1, if given without argument, defaults to number of CPU cores ({} in this system).'.format(self.ncores))
+		parser.add_argument('--scan-workers', metavar = 'NUMBER', dest = 'scan_workers', type = int, default = self.ncores, help = 'Number of threads reading the local photos. Default is the number of CPU cores ({} in this system).'.format(self.ncores))
+		parser.add_argument('--transform-workers', metavar = 'NUMBER', dest = 'transform_workers', type = int, default = self.ncores, help = 'Number of processes transforming photos before upload when using --transform or --strip-exif. 0 transforms them in the photo processing threads. Default is the number of CPU cores ({} in this system).'.format(self.ncores))
+		parser.add_argument('--upload-workers', metavar = 'NUMBER', dest = 'upload_workers', type = int, help = 'Number of threads uploading transformed photos. Default is the number of photo processing threads.')
+		parser.add_argument('--download-workers', metavar = 'NUMBER', dest = 'download_workers', type = int, default = 0, help = 'Number of threads downloading photos. Default is 0, which downloads them in the photo processing threads.')
+		parser.add_argument('--clients', metavar = 'NUMBER', dest = 'clients', type = int, help = 'Maximum number of Picasa connections, opened as they are needed. Default is the number of photo processing threads plus upload threads.')
+		parser.add_argument('--detect-moves', dest = 'detect_moves', action = 'store_true', help = 'Move remote photos between albums when their local files have been moved, instead of uploading them again. Only when uploading.')
+		parser.add_argument('--batch-size', metavar = 'NUMBER', dest = 'batch_size', type = int, default = self.BATCH_SIZE, help = 'Number of photo deletions or metadata updates sent together in a single request. 1 disables batching. Default is {}.'.format(self.BATCH_SIZE))
+		parser.add_argument('--max-inflight-bytes', metavar = 'SIZE', dest = 'max_inflight_bytes', type = _parse_size, help = 'Limit the size of the transformed photos held in memory at the same time to SIZE bytes (K, M or G suffixes allowed). Photos sent untransformed are streamed from their files and not counted. Default is no limit.')
+		parser.add_argument('--request-rate', metavar = 'REQUESTS', dest = 'request_rate', type = float, default = self.REQUEST_RATE, help = 'Maximum number of Picasa requests per second. It is lowered while Picasa throttles the requests. Default is {}.'.format(self.REQUEST_RATE))
+		parser.add_argument('--retries', metavar = 'NUMBER', dest = 'retries', type = int, default = self.RETRIES, help = 'Number of times a throttled or failed Picasa request is retried. Default is {}.'.format(self.RETRIES))
 		parser.add_argument('-o', '--origin', dest = 'origin', metavar = 'ORIGINS', type = ListParser(choices = ('filename', 'exif', 'stat')), default = ['exif', 'stat'], help = 'Timestamp origin. ORIGINS is a comma separated list of values "filename", "exif" or "stat" which will be probed in order. Default is "exif,stat".')
+		parser.add_argument('--since', metavar = 'TIME', dest = 'since', type = _parse_time, help = 'Only compare albums changed locally or remotely after TIME')
+		parser.add_argument('--state-db', metavar = 'FILE', dest = 'state_db', help = 'Local state database used to skip unchanged files. Default is "{}" in the first PATH.'.format(StateDB.FILENAME))
+		parser.add_argument('--no-state-db', dest = 'no_state_db', action = 'store_true', help = 'Do not use the local state database')
+		parser.add_argument('--rebuild-state', dest = 'rebuild_state', action = 'store_true', help = 'Discard the local state database and build it again while syncing')
+		parser.add_argument('--verify-state', dest = 'verify_state', action = 'store_true', help = 'Check every entry of the local state database against the disk, fix it and exit')
+		parser.add_argument('--journal', metavar = 'FILE', dest = 'journal', help = 'Journal of the operations completed while syncing, removed when the sync finishes. Default is "{}" in the first PATH.'.format(Journal.FILENAME))
+		parser.add_argument('--resume', dest = 'resume', action = 'store_true', help = 'Skip the photos and albums an interrupted sync left in its journal')
+		parser.add_argument('--status', dest = 'status', action = 'store_true', help = 'Show the local photos that changed since they were last synced, using only the local state database, and exit. The exit status is 1 if there is any.')
+		parser.add_argument('--plan', metavar = 'FILE', dest = 'plan', help = 'Write the operations needed to sync to FILE, one JSON object per line, without changing anything')
+		parser.add_argument('--execute', metavar = 'FILE', dest = 'execute', help = 'Run the operations of a plan written with --plan, without scanning the local albums or listing the remote ones. No PATH is needed. --force-update, --transform, --max-size and --strip-exif must be the same ones used with --plan.')
+		parser.add_argument('--metrics', metavar = 'FILE', dest = 'metrics', help = 'Write the timers and counters of the run to FILE when it ends, in the Prometheus text format if FILE ends in ".prom" or as JSON otherwise')
+		parser.add_argument('--profile', metavar = 'DIR', dest = 'profile', help = 'Profile the run with cProfile and write the stats of every thread to its own file in DIR')
+		parser.add_argument('--server', metavar = 'URL', dest = 'server', help = 'Picasa server to use instead of the real one, like the local stand-in in bench/fakepicasa.py')
 		group = parser.add_argument_group('DANGEROUS', 'Dangerous options that should be used with care')
 		group.add_argument('--max-size', dest = 'max_size', type = ListParser(unique = False, type = int, nargs = 2), default = self.MAX_PHOTO_SIZE, help = 'Maximum size of photo when using --transform=resize. Default is {},{}.'.format(*self.MAX_PHOTO_SIZE))
 		group.add_argument('--force-update', dest = 'force_update', choices = ('full', 'metadata'), nargs = '?', const = 'full', help = 'Force updating photos regardless of modified status (Assumes --update). If no argument given, it assumes full.')
 		group.add_argument('--delete-photos', dest = 'delete_photos', action = 'store_true', help = 'Delete remote or local photos not present on the other album')
 		group.add_argument('--strip-exif', dest = 'strip_exif', action = 'store_true', help = 'Strip EXIF data from your photos on upload.')
 		group.add_argument('--transform', dest = 'transform', metavar = 'TRANSFORMS', type = ListParser(choices = ('raw', 'rotate', 'resize')), help = 'Transform the local files before uploading them. TRANSFORMS is a list of transformations to apply, from "raw", "rotate" and "resize".')
+		group.add_argument('--transform-cache', metavar = 'DIR', dest = 'transform_cache', help = 'Keep the transformed photos in DIR, so they are not transformed again when the upload has to be repeated.')
+		group.add_argument('--transform-cache-size', metavar = 'MB', dest = 'transform_cache_size', type = int, default = self.TRANSFORM_CACHE_SIZE, help = 'Maximum size of the transformed photos cache in megabytes. Default is {}.'.format(self.TRANSFORM_CACHE_SIZE))
 		group = parser.add_argument_group('VERY DANGEROUS', 'Very dangerous options that should be used with extreme care')
 		group.add_argument('--delete-albums', dest = 'delete_albums', action = 'store_true', help = 'Delete remote or local albums not present on the other system')
-		parser.add_argument('paths', metavar = 'PATH', nargs = '+', help = 'Parent directory of the albums to sync')
+		parser.add_argument('paths', metavar = 'PATH', nargs = '*', help = 'Parent directory of the albums to sync')
 		cl_args = parser.parse_args()
 
+		if not cl_args.paths and not cl_args.execute:
+			parser.error('at least one PATH is needed')
+		if cl_args.plan and cl_args.execute:
+			parser.error('--plan and --execute cannot be used together')
+
 		if cl_args.verbose == 1:
 			log_level = logging.INFO
 		elif cl_args.verbose >= 2:
@@ -640,9 +1410,37 @@ class PicasaSync(object):
 			self.LOG.warn('You cannot force update when using bidirectional syncing. Disabling forced updates.')
 			cl_args.force_update = False
 
+		if cl_args.transform_cache and (cl_args.transform or cl_args.strip_exif):
+			cl_args.transform_cache = TransformCache(cl_args.transform_cache, cl_args.transform_cache_size * 1024 * 1024)
+		else:
+			cl_args.transform_cache = None
+
+		if 'stat' not in cl_args.origin:
+			cl_args.origin.append('stat')
+
+		cl_args.inflight_budget = ByteBudget(cl_args.max_inflight_bytes) if cl_args.max_inflight_bytes else None
+
+		if not cl_args.transform and not cl_args.strip_exif:
+			cl_args.transform_workers = 0
+		if not cl_args.transform_workers:
+			cl_args.upload_workers = 0
+		elif not cl_args.upload_workers:
+			cl_args.upload_workers = cl_args.threads
+
+		if not cl_args.clients:
+			cl_args.clients = cl_args.threads + cl_args.upload_workers
+		elif cl_args.upload_workers and cl_args.clients <= cl_args.upload_workers:
+			# A photo processing thread may hold a client while it waits for the upload threads
+			self.LOG.warn('You need more Picasa connections than upload threads. Using {}.'.format(cl_args.upload_workers + 1))
+			cl_args.clients = cl_args.upload_workers + 1
+
 		if cl_args.force_update and not cl_args.update:
 			cl_args.update = True
 
+		if cl_args.detect_moves and cl_args.download:
+			self.LOG.warn('You cannot detect moved photos when downloading. Disabling move detection.')
+			cl_args.detect_moves = False
+
 		if len(cl_args.paths) > 1 and (cl_args.download or cl_args.delete_albums):
 			self.LOG.warn('You cannot download or delete albums when using more than one directories. Disabling download and/or album deletion.')
 			cl_args.download = False
@@ -652,7 +1450,7 @@ class PicasaSync(object):
 
 def main():
 	try:
-		PicasaSync().sync()
+		sys.exit(PicasaSync().sync())
 	except KeyboardInterrupt:
 		pass
 
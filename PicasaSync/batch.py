@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+
+import logging, threading, collections
+
+from lazy import gdata
+from metrics import metrics
+
+class BatchQueue(object):
+	"""Collect photo queries, deletions and metadata updates per album and send them as GData batch requests.
+
+	Queries and deletions take the URI of the entry and updates the whole entry. Every operation carries a callback that
+	is called with the resulting entry and None, or None and an error message, once the batch holding it has been sent.
+	"""
+	LOG = logging.getLogger('BatchQueue')
+	URL = '/data/feed/api/user/default/albumid/%s/batch'
+	QUERY = 'query'
+	DELETE = 'delete'
+	UPDATE = 'update'
+
+	def __init__(self, clients, size):
+		self.clients = clients
+		self.size = size
+		self.lock = threading.Lock()
+		self.pending = collections.OrderedDict()
+
+	def add(self, album_id, operation, entry, callback):
+		with self.lock:
+			operations = self.pending.setdefault(album_id, [])
+			operations.append((operation, entry, callback))
+			if len(operations) < self.size:
+				return
+			del self.pending[album_id]
+		self.execute(album_id, operations)
+
+	def flush(self, album_id = None):
+		"""Send the pending operations of album_id, or of every album, including those their callbacks add."""
+		while True:
+			with self.lock:
+				if album_id is None:
+					if not self.pending:
+						return
+					album, operations = self.pending.popitem(last = False)
+				else:
+					album, operations = album_id, self.pending.pop(album_id, None)
+					if not operations:
+						return
+			self.execute(album, operations)
+
+	def execute(self, album_id, operations):
+		feed = gdata.BatchFeed()
+		for i, (operation, entry, callback) in enumerate(operations):
+			if operation == self.QUERY:
+				feed.AddQuery(url_string = entry, batch_id_string = str(i))
+			elif operation == self.DELETE:
+				feed.AddDelete(url_string = entry, batch_id_string = str(i))
+			else:
+				# Only a BatchEntry serializes the batch id and operation, a PhotoEntry drops them
+				feed.AddUpdate(gdata.BatchEntryFromString(entry.ToString()), batch_id_string = str(i))
+		self.LOG.debug(u'Sending {} operations for album {}'.format(len(operations), album_id))
+		with self.clients.checkout() as client:
+			try:
+				with metrics.timer('batch'):
+					# The photos service has no ExecuteBatch, so the feed is posted like any other
+					result = client.Post(feed, self.URL % album_id, converter = gdata.BatchFeedFromString)
+			except (gdata.photos.service.GooglePhotosException, gdata.service.RequestError) as e:
+				for operation, entry, callback in operations:
+					callback(None, str(e))
+				return
+		done = set()
+		for entry in result.entry:
+			i = int(entry.batch_id.text)
+			done.add(i)
+			if int(entry.batch_status.code) >= 300:
+				operations[i][2](None, '{} {}'.format(entry.batch_status.code, entry.batch_status.reason))
+			else:
+				operations[i][2](entry, None)
+		for i, (operation, entry, callback) in enumerate(operations):
+			if i not in done:
+				callback(None, 'Missing from the batch response')
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+
+import logging, os, threading, Queue, httplib, urlparse, collections, json
+
+from metrics import metrics
+
+class DownloadError(EnvironmentError): pass
+
+class ConnectionPool(object):
+	"""Keep-alive HTTP connections, with a free list per scheme and host."""
+	def __init__(self, timeout = 60):
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self.free = collections.defaultdict(list)
+
+	def get(self, scheme, netloc):
+		with self.lock:
+			if self.free[(scheme, netloc)]:
+				return self.free[(scheme, netloc)].pop()
+		if scheme == 'https':
+			return httplib.HTTPSConnection(netloc, timeout = self.timeout)
+		return httplib.HTTPConnection(netloc, timeout = self.timeout)
+
+	def put(self, scheme, netloc, connection):
+		with self.lock:
+			self.free[(scheme, netloc)].append(connection)
+
+	def close(self):
+		with self.lock:
+			for connections in self.free.itervalues():
+				for connection in connections:
+					connection.close()
+			self.free.clear()
+
+class DownloadEngine(object):
+	"""Download files over pooled keep-alive connections, resuming any partial download left by a previous run.
+
+	Data is written to path + '.part', and the callback given to submit is called with None or the error once the
+	download ends. With no workers downloads run inline in the submitting thread.
+
+	Next to the partial file, path + '.part.info' keeps the version of the remote file given to submit and the ETag
+	or Last-Modified header of the server. A partial file is only resumed for the same version, and with If-Range
+	when there is a validator, so a file changed in between is downloaded whole instead of appended to the old one.
+
+	The queue holds up to QUEUE_PER_WORKER downloads per worker, so submit blocks when the photo tasks get ahead of
+	the downloads instead of queueing the whole account.
+	"""
+	LOG = logging.getLogger('DownloadEngine')
+	CHUNK_SIZE = 1 << 16
+	MAX_REDIRECTS = 5
+	RETRIES = 3
+	QUEUE_PER_WORKER = 4
+
+	def __init__(self, workers = 0):
+		self.connections = ConnectionPool()
+		self.queue = Queue.Queue(maxsize = workers * self.QUEUE_PER_WORKER)
+		self.threads = []
+		for i in xrange(workers):
+			thread = threading.Thread(target = self.worker)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def submit(self, url, path, callback, version = None, size = None):
+		if not self.threads:
+			return self.run(url, path, callback, version, size)
+		self.queue.put((url, path, callback, version, size))
+		metrics.gauge('download_queue', self.queue.qsize())
+
+	@metrics.timed('download')
+	def run(self, url, path, callback, version = None, size = None):
+		tmpfilename = path + '.part'
+		error = None
+		for attempt in xrange(self.RETRIES):
+			try:
+				self.fetch(url, tmpfilename, version)
+				received = os.path.getsize(tmpfilename)
+				if size is not None and received != size:
+					# Retried from the start
+					self.discard(tmpfilename)
+					raise IOError(u'Downloaded {} bytes instead of {}'.format(received, size))
+			except DownloadError as e:
+				error = e
+				break
+			except (EnvironmentError, httplib.HTTPException) as e:
+				error = e
+				self.LOG.debug(u'Error downloading "{}" (attempt {}): '.format(path, attempt + 1) + str(e))
+			else:
+				error = None
+				self.remove(tmpfilename + '.info')
+				break
+		callback(error)
+
+	@staticmethod
+	def remove(path):
+		try:
+			os.remove(path)
+		except EnvironmentError:
+			pass
+
+	def discard(self, tmpfilename):
+		self.remove(tmpfilename)
+		self.remove(tmpfilename + '.info')
+
+	def resume(self, tmpfilename, version):
+		"""Return the headers resuming the partial file, or discard it if it cannot be resumed."""
+		try:
+			offset = os.path.getsize(tmpfilename)
+			with open(tmpfilename + '.info') as f:
+				info = json.load(f)
+		except (EnvironmentError, ValueError):
+			self.discard(tmpfilename)
+			return {}
+		# Without a version nor a validator nothing tells whether the remote file is still the same
+		if not offset or info.get('version') != version or not (version or info.get('validator')):
+			self.discard(tmpfilename)
+			return {}
+		headers = {'Range': 'bytes={}-'.format(offset)}
+		if info.get('validator'):
+			headers['If-Range'] = info['validator']
+		return headers
+
+	def fetch(self, url, tmpfilename, version = None):
+		for redirect in xrange(self.MAX_REDIRECTS):
+			scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+			headers = self.resume(tmpfilename, version)
+			connection = self.connections.get(scheme, netloc)
+			try:
+				connection.request('GET', urlparse.urlunsplit(('', '', path, query, '')), headers = headers)
+				response = connection.getresponse()
+				if response.status in (301, 302, 303, 307):
+					response.read()
+					url = urlparse.urljoin(url, response.getheader('location'))
+				elif response.status == 416:
+					# The partial file is not a prefix of the remote one anymore, start over
+					response.read()
+					self.discard(tmpfilename)
+				elif response.status in (200, 206):
+					if response.status == 200:
+						with open(tmpfilename + '.info', 'w') as f:
+							json.dump({'version': version, 'validator': response.getheader('etag') or response.getheader('last-modified')}, f)
+					with open(tmpfilename, 'ab' if response.status == 206 else 'wb') as f:
+						while True:
+							data = response.read(self.CHUNK_SIZE)
+							if not data:
+								break
+							f.write(data)
+							metrics.count('bytes_downloaded', len(data))
+				else:
+					response.read()
+					raise DownloadError(u'HTTP error {} {}'.format(response.status, response.reason))
+			except:
+				connection.close()
+				raise
+			if response.will_close:
+				connection.close()
+			else:
+				self.connections.put(scheme, netloc, connection)
+			if response.status in (200, 206):
+				return
+		raise DownloadError(u'Too many redirects')
+
+	def worker(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				self.run(*item)
+			except Exception:
+				self.LOG.exception('Error downloading photo')
+			finally:
+				self.queue.task_done()
+
+	def join(self):
+		with self.queue.all_tasks_done:
+			while self.queue.unfinished_tasks:
+				self.queue.all_tasks_done.wait(0.5)
+		for thread in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+		self.connections.close()
@@ -6,66 +6,55 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import defaultdict
-from functools import wraps
+from types import MethodType
 import string
 import inspect
 import logging
+import re
 
 
 class dryrun(object):
-    class Formatter(string.Formatter):
-        def __init__(self, argspec):
-            self.argspec = argspec
-
-        def vformat(self, format_string, args, kwargs):
-            values = defaultdict(str)
-            if self.argspec.defaults:
-                values.update(dict(zip(self.argspec.args[-len(self.argspec.defaults):], self.argspec.defaults)))
-            values.update(dict(zip(self.argspec.args, args)))
-            values.update(kwargs)
-            formatted = super(dryrun.Formatter, self).vformat(format_string, args, values)
-            if not self.argspec.keywords:
-                for k in (k for k in self.used_args if k in kwargs and k not in self.argspec.args):
-                    del kwargs[k]
-            return formatted
-
-        def check_unused_args(self, used_args, args, kwargs):
-            self.used_args = used_args
+    formatter = string.Formatter()
 
     class descript(object):
         def __init__(self, f, expr, logger, message, prefix, levels):
             self.f = f
             self.expr = expr
+            self.code = compile(expr, '<dryrun>', 'eval')
             self.logger = logger
             self.prefix = prefix
             self.message = message
             self.levels = levels
+            self.argspec = inspect.getargspec(f)
+            self.defaults = {}
+            if self.argspec.defaults:
+                self.defaults = dict(zip(self.argspec.args[-len(self.argspec.defaults):], self.argspec.defaults))
+            # Keyword arguments only meant for the message, which f does not accept
+            fields = set(re.match(r'[^.[]*', field).group(0) for literal, field, spec, conversion in dryrun.formatter.parse(message) if field)
+            self.message_only = frozenset() if self.argspec.keywords else frozenset(fields.difference(self.argspec.args))
 
         def __get__(self, instance, klass):
             if instance is not None:
                 return self.make_bound(instance)
 
         def __call__(self, *args, **kwargs):
-            return self.run(None, args, kwargs)
+            return self.run(args, kwargs)
 
         def make_bound(self, instance):
-            @wraps(self.f)
-            def wrapper(*args, **kwargs):
-                return self.run(instance, (instance,) + args, kwargs)
-            setattr(instance, self.f.__name__, wrapper)
-            return wrapper
+            return MethodType(self, instance)
 
-        def run(self, instance, args, kwargs):
-            argspec = inspect.getargspec(self.f)
-            local = vars(instance) if instance else self.f.func_dict
-            if argspec.defaults:
-                local.update(dict(zip(argspec.args[-len(argspec.defaults):], argspec.defaults)))
-            local.update(dict(zip(argspec.args, args)))
-            local.update(kwargs)
-            dry_run = eval(self.expr, self.f.func_globals, local)
-            message = dryrun.Formatter(argspec).vformat((self.prefix if dry_run else '') + self.message, args, kwargs)
-            self.logger.log(self.levels[0] if not dry_run else self.levels[1], message)
+        def run(self, args, kwargs):
+            values = dict(self.defaults)
+            values.update(zip(self.argspec.args, args))
+            values.update(kwargs)
+            dry_run = eval(self.code, self.f.func_globals, values)
+            level = self.levels[1] if dry_run else self.levels[0]
+            if self.logger.isEnabledFor(level):
+                message = dryrun.formatter.vformat((self.prefix if dry_run else '') + self.message, args, defaultdict(str, values))
+                self.logger.log(level, message)
             if not dry_run:
+                for k in self.message_only.intersection(kwargs):
+                    del kwargs[k]
                 return self.f(*args, **kwargs)
 
     def __init__(self, expr, logger, message, prefix='[DRYRUN] ', levels=(logging.INFO, logging.WARN)):
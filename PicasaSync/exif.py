@@ -0,0 +1,186 @@
+#! /usr/bin/env python
+
+import struct, calendar, time, cStringIO, shutil
+
+ORIENTATION = 0x0112
+DATETIME = 0x0132
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 0x9003
+ASCII = 2
+SHORT = 3
+LONG = 4
+IFD = 13
+
+SOI = '\xff\xd8'
+APP0 = 0xe0
+APP1 = 0xe1
+APP13 = 0xed
+COM = 0xfe
+SOS = 0xda
+EOI = 0xd9
+# EXIF and XMP, IPTC and comments
+METADATA_SEGMENTS = (APP1, APP13, COM)
+
+class ExifError(Exception): pass
+
+class TiffReader(object):
+	"""Read IFD entries from a TIFF structure starting at base in an open file, seeking only to what is needed."""
+	def __init__(self, f, base):
+		self.f = f
+		self.base = base
+		self.f.seek(base)
+		header = self.f.read(8)
+		if header[:4] == 'II*\x00':
+			self.endian = '<'
+		elif header[:4] == 'MM\x00*':
+			self.endian = '>'
+		else:
+			raise ExifError('Invalid TIFF header')
+		self.first_ifd = struct.unpack(self.endian + 'I', header[4:8])[0]
+
+	def read(self, offset, size):
+		self.f.seek(self.base + offset)
+		data = self.f.read(size)
+		if len(data) != size:
+			raise ExifError('Truncated TIFF structure')
+		return data
+
+	def entries(self, offset):
+		count = struct.unpack(self.endian + 'H', self.read(offset, 2))[0]
+		data = self.read(offset + 2, count * 12)
+		for i in xrange(count):
+			yield struct.unpack(self.endian + 'HHI4s', data[i * 12:i * 12 + 12])
+
+	def ascii(self, count, value):
+		if count > 4:
+			value = self.read(struct.unpack(self.endian + 'I', value)[0], count)
+		return value[:count].split('\x00', 1)[0]
+
+	def long(self, value):
+		return struct.unpack(self.endian + 'I', value)[0]
+
+def _tiff_base(f):
+	"""Return the offset of the TIFF structure holding the EXIF data of a JPEG or TIFF based file."""
+	f.seek(0)
+	start = f.read(4)
+	if start[:4] in ('II*\x00', 'MM\x00*'):
+		return 0
+	if start[:2] != '\xff\xd8':
+		raise ExifError('Unknown file format')
+	offset = 2
+	while True:
+		f.seek(offset)
+		header = f.read(4)
+		if len(header) < 4 or header[0] != '\xff':
+			raise ExifError('Invalid JPEG segment')
+		marker = ord(header[1])
+		length = struct.unpack('>H', header[2:4])[0]
+		# Start of scan or end of image, there is no metadata after them
+		if marker in (0xda, 0xd9):
+			raise ExifError('No EXIF segment')
+		if marker == 0xe1 and f.read(6) == 'Exif\x00\x00':
+			return offset + 10
+		offset += 2 + length
+
+def _timestamp(value):
+	try:
+		return calendar.timegm(time.strptime(value.strip(), '%Y:%m:%d %H:%M:%S'))
+	except ValueError:
+		return None
+
+def read_datetimes(path):
+	"""Return a dict with the 'DateTime' and 'DateTimeOriginal' timestamps found in the EXIF data of path.
+
+	Only the bytes of the EXIF structure leading to those tags are read. A tag missing or holding an invalid date is
+	left out of the dict. ExifError is raised when the file is not a JPEG or TIFF based file this parser can walk, so
+	the caller can fall back to a full metadata reader.
+	"""
+	result = {}
+	with open(path, 'rb') as f:
+		try:
+			tiff = TiffReader(f, _tiff_base(f))
+			exif_ifd = None
+			for tag, kind, count, value in tiff.entries(tiff.first_ifd):
+				if tag == DATETIME and kind == ASCII:
+					result['DateTime'] = _timestamp(tiff.ascii(count, value))
+				elif tag == EXIF_IFD and kind in (LONG, IFD):
+					exif_ifd = tiff.long(value)
+			if exif_ifd:
+				for tag, kind, count, value in tiff.entries(exif_ifd):
+					if tag == DATETIME_ORIGINAL and kind == ASCII:
+						result['DateTimeOriginal'] = _timestamp(tiff.ascii(count, value))
+						break
+		except struct.error:
+			raise ExifError('Truncated EXIF data')
+	return dict((k, v) for (k, v) in result.iteritems() if v is not None)
+
+def _segments(f):
+	"""Yield the marker and the whole bytes of every JPEG segment in f, from after SOI up to the image data, leaving f
+	at the start of the image data."""
+	while True:
+		header = f.read(4)
+		if len(header) < 4 or header[0] != '\xff':
+			raise ExifError('Invalid JPEG segment')
+		marker = ord(header[1])
+		if marker in (SOS, EOI):
+			f.seek(-4, 1)
+			return
+		length = struct.unpack('>H', header[2:4])[0]
+		body = f.read(length - 2)
+		if len(body) != length - 2:
+			raise ExifError('Truncated JPEG segment')
+		yield marker, header + body
+
+def strip_metadata(f):
+	"""Return the JPEG in the open file f without its EXIF, XMP and IPTC segments and comments.
+
+	Only the segments before the image data are parsed, the image data itself is copied as it is.
+	"""
+	if f.read(2) != SOI:
+		raise ExifError('Not a JPEG file')
+	out = cStringIO.StringIO()
+	out.write(SOI)
+	for marker, segment in _segments(f):
+		if marker not in METADATA_SEGMENTS:
+			out.write(segment)
+	shutil.copyfileobj(f, out)
+	return out.getvalue()
+
+def metadata_segments(f):
+	"""Return the EXIF, XMP and IPTC segments and comments of the JPEG in the open file f."""
+	if f.read(2) != SOI:
+		raise ExifError('Not a JPEG file')
+	return [segment for marker, segment in _segments(f) if marker in METADATA_SEGMENTS]
+
+def reset_orientation(segment):
+	"""Return the segment with the EXIF Orientation tag set to 1, if it is an EXIF segment holding it."""
+	if segment[4:10] != 'Exif\x00\x00':
+		return segment
+	try:
+		tiff = TiffReader(cStringIO.StringIO(segment), 10)
+		for i, (tag, kind, count, value) in enumerate(tiff.entries(tiff.first_ifd)):
+			if tag == ORIENTATION and kind == SHORT:
+				offset = 10 + tiff.first_ifd + 2 + i * 12 + 8
+				return segment[:offset] + struct.pack(tiff.endian + 'H', 1) + segment[offset + 2:]
+	except (ExifError, struct.error):
+		pass
+	return segment
+
+def insert_metadata(data, segments):
+	"""Return the JPEG data with segments in place of its own metadata segments, right after its JFIF header."""
+	f = cStringIO.StringIO(data)
+	if f.read(2) != SOI:
+		raise ExifError('Not a JPEG file')
+	parts = [SOI]
+	inserted = False
+	for marker, segment in _segments(f):
+		if marker in METADATA_SEGMENTS:
+			continue
+		if not inserted and marker != APP0:
+			parts.extend(segments)
+			inserted = True
+		parts.append(segment)
+	if not inserted:
+		parts.extend(segments)
+	parts.append(data[f.tell():])
+	return ''.join(parts)
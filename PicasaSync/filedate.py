@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+import re, calendar, datetime, threading
+
+from lazy import dateutil
+
+class FilenameDates(object):
+	"""Find the timestamp written in a file or directory name.
+
+	Common camera and phone naming schemes are matched with precompiled patterns. Anything else goes through the old
+	fuzzy dateutil probing, starting at every digit of the name. Results are memoized per name, and the dateutil
+	probes per suffix, since names in the same directory usually share them.
+	"""
+	DIGIT = re.compile(r'\d')
+	PATTERNS = (
+		# IMG_20120304_101112, VID_20120304_101112, 2012-03-04 10.11.12, 20120304-101112, 2012_03_04
+		re.compile(r'(?<!\d)(?P<Y>(?:19|20)\d\d)(?P<s>[-_.]?)(?P<m>[01]\d)(?P=s)(?P<d>[0-3]\d)(?:[ T_-]?(?P<H>[0-2]\d)[-_.:h]?(?P<M>[0-5]\d)(?:[-_.:m]?(?P<S>[0-5]\d))?)?(?!\d)'),
+		# 04-03-2012, 04.03.2012 10.11.12 (day first, as the dateutil probing)
+		re.compile(r'(?<!\d)(?P<d>[0-3]\d)(?P<s>[-_.])(?P<m>[01]\d)(?P=s)(?P<Y>(?:19|20)\d\d)(?:[ T_-](?P<H>[0-2]\d)[-_.:h](?P<M>[0-5]\d)(?:[-_.:m](?P<S>[0-5]\d))?)?(?!\d)'),
+	)
+	MAX_CACHE = 100000
+	# Raised whenever some names get a different timestamp, so the ones cached in the state database are probed again
+	VERSION = 2
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.names = {}
+		self.suffixes = {}
+
+	def _remember(self, cache, key, value):
+		with self.lock:
+			if len(cache) >= self.MAX_CACHE:
+				cache.clear()
+			cache[key] = value
+
+	def match(self, name):
+		for pattern in self.PATTERNS:
+			for m in pattern.finditer(name):
+				fields = m.groupdict()
+				try:
+					return calendar.timegm(datetime.datetime(*[int(fields[k] or 0) for k in ('Y', 'm', 'd', 'H', 'M', 'S')]).timetuple())
+				except ValueError:
+					pass
+		return None
+
+	def probe(self, name):
+		for m in self.DIGIT.finditer(name):
+			suffix = name[m.start():]
+			try:
+				timestamp = self.suffixes[suffix]
+			except KeyError:
+				try:
+					timestamp = calendar.timegm(dateutil.parser.parse(suffix, fuzzy = True, dayfirst = True).timetuple())
+				except ValueError:
+					timestamp = None
+				self._remember(self.suffixes, suffix, timestamp)
+			if timestamp:
+				return timestamp
+		return None
+
+	def timestamp(self, name):
+		try:
+			return self.names[name]
+		except KeyError:
+			pass
+		timestamp = self.match(name) or self.probe(name)
+		self._remember(self.names, name, timestamp)
+		return timestamp
+
+filename_dates = FilenameDates()
+
+def filename_timestamp(name):
+	return filename_dates.timestamp(name)
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+import logging, os, json, time, threading
+
+class Journal(object):
+	"""Append-only log of the operations completed during a sync, so an interrupted run can be resumed.
+
+	Every line is a JSON object for a created album or an uploaded or downloaded photo, with the remote entry it
+	ended with. Lines reach the OS as soon as they are written, so they survive the process dying, but they are only
+	fsynced every SYNC_EVERY records or SYNC_INTERVAL seconds. A machine crash can lose that window, which is then
+	just checked again.
+	"""
+	LOG = logging.getLogger('Journal')
+	FILENAME = '.picasasync.journal'
+	SYNC_EVERY = 100
+	SYNC_INTERVAL = 5.0
+
+	def __init__(self, path, resume = False):
+		self.path = path
+		self.lock = threading.Lock()
+		self.albums = {}
+		self.photos = {}
+		if resume:
+			self.replay()
+		self.f = open(path, 'a' if resume else 'w')
+		# Do not glue the first new record to a line torn by the crash
+		if self.f.tell() > 0:
+			with open(path, 'rb') as f:
+				f.seek(-1, os.SEEK_END)
+				if f.read(1) != '\n':
+					self.f.write('\n')
+		self.pending = 0
+		self.synced = time.time()
+
+	def replay(self):
+		if not os.path.exists(self.path):
+			return
+		with open(self.path) as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					continue
+				if record['kind'] == 'album':
+					self.albums[record['title']] = record['entry']
+				else:
+					self.photos[record['path']] = record
+		self.LOG.info('Resuming with {} albums and {} photos already synced'.format(len(self.albums), len(self.photos)))
+
+	def record(self, record):
+		line = json.dumps(record, sort_keys = True)
+		with self.lock:
+			# Workers still running after an interruption
+			if self.f.closed:
+				return
+			self.f.write(line + '\n')
+			self.f.flush()
+			self.pending += 1
+			if self.pending >= self.SYNC_EVERY or time.time() - self.synced >= self.SYNC_INTERVAL:
+				self.sync()
+
+	def sync(self):
+		os.fsync(self.f.fileno())
+		self.pending = 0
+		self.synced = time.time()
+
+	def albumCreated(self, title, entry):
+		self.record({'kind': 'album', 'title': title, 'entry': entry})
+
+	def photoSynced(self, op, path, st, entry):
+		self.record({'kind': 'photo', 'op': op, 'path': os.path.abspath(path), 'size': st.st_size, 'mtime': st.st_mtime, 'entry': entry})
+
+	def album(self, title):
+		"""Return the entry of the album title if it was created by the interrupted run."""
+		return self.albums.get(title)
+
+	def photo(self, path):
+		"""Return the entry of the photo at path if it was synced by the interrupted run and has not changed since."""
+		record = self.photos.get(os.path.abspath(path))
+		if not record:
+			return None
+		try:
+			st = os.stat(path)
+		except EnvironmentError:
+			return None
+		if (st.st_size, st.st_mtime) != (record['size'], record['mtime']):
+			return None
+		return record['entry']
+
+	def close(self, finished = False):
+		"""Close the journal, removing it when the sync finished and there is nothing to resume."""
+		with self.lock:
+			self.sync()
+			self.f.close()
+		if finished:
+			os.remove(self.path)
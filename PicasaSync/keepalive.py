@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+
+import socket, httplib
+
+import atom.http
+
+from ratelimit import rewind
+
+class KeepAliveHttpClient(atom.http.ProxiedHttpClient):
+	"""HTTP client for a GData service that keeps its connection to each host open between requests.
+
+	A client is only used by one thread at a time and GData reads every response before sending the next request, so
+	one connection per host is enough. A request failing on a reused connection, which the server may have closed
+	while idle, is sent again once on a new one, but only if it is safe to repeat or none of it had been sent yet.
+	"""
+	SAFE = frozenset(['GET', 'HEAD', 'DELETE'])
+
+	def __init__(self, *args, **kwargs):
+		atom.http.ProxiedHttpClient.__init__(self, *args, **kwargs)
+		self.connections = {}
+		self.reused = False
+		self.sent = False
+
+	def _prepare_connection(self, url, headers):
+		key = (url.protocol, url.host, url.port)
+		connection = self.connections.get(key)
+		self.reused = connection is not None
+		if connection is None:
+			connection = self.connections[key] = atom.http.ProxiedHttpClient._prepare_connection(self, url, headers)
+			send = connection.send
+			def sending(data):
+				self.sent = True
+				send(data)
+			connection.send = sending
+		return connection
+
+	def request(self, operation, url, data = None, headers = None):
+		self.sent = False
+		try:
+			return atom.http.ProxiedHttpClient.request(self, operation, url, data = data, headers = headers)
+		except (socket.error, httplib.HTTPException):
+			self.close()
+			# The server may have acted on a request it got even partly, so only a safe one is repeated
+			if not self.reused or (self.sent and operation not in self.SAFE):
+				raise
+		rewind(data)
+		return atom.http.ProxiedHttpClient.request(self, operation, url, data = data, headers = headers)
+
+	def close(self):
+		for connection in self.connections.itervalues():
+			connection.close()
+		self.connections.clear()
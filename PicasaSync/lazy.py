@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+
+import importlib
+
+class LazyModule(object):
+	"""Stand-in for a module that is only imported when one of its attributes is first used.
+
+	Submodules are imported along with it, or else when they are first used as one of its attributes. If the import
+	fails the program exits with hint. Call load() to import it up front, so a missing module is found before any
+	thread starts.
+	"""
+	def __init__(self, name, hint = None, submodules = ()):
+		self.__dict__.update(_name = name, _hint = hint, _submodules = submodules, _module = None)
+
+	def load(self):
+		if self._module is None:
+			try:
+				module = importlib.import_module(self._name)
+				for submodule in self._submodules:
+					importlib.import_module(submodule)
+			except ImportError:
+				if self._hint:
+					raise SystemExit(self._hint)
+				raise
+			self.__dict__['_module'] = module
+		return self._module
+
+	def __getattr__(self, attr):
+		module = self.load()
+		try:
+			return getattr(module, attr)
+		except AttributeError:
+			pass
+		try:
+			return importlib.import_module(self._name + '.' + attr)
+		except ImportError:
+			raise AttributeError(attr)
+
+_HINT = 'Error importing the {} module. In debian/ubuntu you can install it by doing "sudo apt-get install {}"'
+
+googlecl = LazyModule('googlecl', _HINT.format('googlecl', 'googlecl'))
+picasa = LazyModule('googlecl.picasa', _HINT.format('googlecl', 'googlecl'))
+picasa_service = LazyModule('googlecl.picasa.service', _HINT.format('googlecl', 'googlecl'))
+atom = LazyModule('atom', _HINT.format('googlecl', 'googlecl'))
+gdata = LazyModule('gdata', _HINT.format('googlecl', 'googlecl'), ('gdata.photos', 'gdata.photos.service', 'gdata.service'))
+pyexiv2 = LazyModule('pyexiv2', _HINT.format('pyexiv2', 'python-pyexiv2'))
+dateutil = LazyModule('dateutil', _HINT.format('dateutil', 'python-dateutil'), ('dateutil.parser',))
+Image = LazyModule('Image', _HINT.format('Image', 'python-imaging'))
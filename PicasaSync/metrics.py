@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+import logging, threading, time, os, sys, json, functools, contextlib, collections, cProfile
+
+class Timer(object):
+	def __init__(self):
+		self.count = 0
+		self.seconds = 0.0
+		self.max = 0.0
+
+class Metrics(object):
+	"""Timers, counters and gauges shared by every thread of a run.
+
+	Timers add up the calls and seconds spent in a phase or operation, counters add up values like bytes or requests,
+	and gauges keep the highest value seen, like the depth of a queue.
+	"""
+	LOG = logging.getLogger('Metrics')
+	PREFIX = 'picasasync'
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.timers = collections.defaultdict(Timer)
+		self.counters = collections.defaultdict(int)
+		self.gauges = {}
+
+	def record(self, name, seconds):
+		with self.lock:
+			timer = self.timers[name]
+			timer.count += 1
+			timer.seconds += seconds
+			timer.max = max(timer.max, seconds)
+
+	@contextlib.contextmanager
+	def timer(self, name):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.record(name, time.time() - start)
+
+	def timed(self, name):
+		"""Decorator timing every call of a function."""
+		def decorator(function):
+			@functools.wraps(function)
+			def wrapper(*args, **kwargs):
+				with self.timer(name):
+					return function(*args, **kwargs)
+			return wrapper
+		return decorator
+
+	def count(self, name, value = 1):
+		with self.lock:
+			self.counters[name] += value
+
+	def gauge(self, name, value):
+		with self.lock:
+			self.gauges[name] = max(value, self.gauges.get(name, value))
+
+	def summary(self):
+		with self.lock:
+			if not (self.timers or self.counters or self.gauges):
+				return
+			lines = ['{:<20} {:>8} {:>10} {:>9} {:>9}'.format('Timer', 'Calls', 'Total (s)', 'Avg (s)', 'Max (s)')]
+			for name, timer in sorted(self.timers.iteritems()):
+				lines.append('{:<20} {:>8} {:>10.3f} {:>9.3f} {:>9.3f}'.format(name, timer.count, timer.seconds, timer.seconds / timer.count, timer.max))
+			for name, value in sorted(self.counters.iteritems()):
+				lines.append('{:<20} {:>8}'.format(name, value))
+			for name, value in sorted(self.gauges.iteritems()):
+				lines.append('{:<20} {:>8} (max)'.format(name, value))
+		self.LOG.info('Metrics:\n' + '\n'.join(lines))
+
+	def snapshot(self):
+		with self.lock:
+			return {
+				'timers': dict((name, {'count': t.count, 'seconds': t.seconds, 'max': t.max}) for name, t in self.timers.iteritems()),
+				'counters': dict(self.counters),
+				'gauges': dict(self.gauges),
+				'time': time.time(),
+			}
+
+	def prometheus(self, snapshot):
+		lines = []
+		def metric(name, kind, samples):
+			name = '{}_{}'.format(self.PREFIX, name)
+			lines.append('# TYPE {} {}'.format(name, kind))
+			for labels, value in samples:
+				lines.append('{}{} {}'.format(name, labels, repr(value)))
+		timers = sorted(snapshot['timers'].iteritems())
+		metric('calls_total', 'counter', [('{{timer="{}"}}'.format(name), t['count']) for name, t in timers])
+		metric('seconds_total', 'counter', [('{{timer="{}"}}'.format(name), t['seconds']) for name, t in timers])
+		metric('seconds_max', 'gauge', [('{{timer="{}"}}'.format(name), t['max']) for name, t in timers])
+		for name, value in sorted(snapshot['counters'].iteritems()):
+			metric(name + '_total', 'counter', [('', value)])
+		for name, value in sorted(snapshot['gauges'].iteritems()):
+			metric(name + '_max', 'gauge', [('', value)])
+		metric('last_run_timestamp_seconds', 'gauge', [('', snapshot['time'])])
+		return '\n'.join(lines) + '\n'
+
+	def dump(self, path):
+		"""Write the metrics to path in the Prometheus text format if it ends in ".prom", or as JSON otherwise.
+
+		The file is replaced atomically, so a collector never reads it half written.
+		"""
+		snapshot = self.snapshot()
+		if path.endswith('.prom'):
+			data = self.prometheus(snapshot)
+		else:
+			data = json.dumps(snapshot, indent = 1, sort_keys = True)
+		tmpfilename = path + '.tmp'
+		try:
+			with open(tmpfilename, 'w') as f:
+				f.write(data)
+			os.rename(tmpfilename, path)
+		except EnvironmentError as e:
+			self.LOG.error(u'Cannot write metrics to "{}": '.format(path) + str(e))
+
+class Profiler(object):
+	"""Profile the main thread and every thread started after start() with cProfile.
+
+	stop() writes the stats of each thread to its own file in a directory, to be read with the pstats module.
+	"""
+	LOG = logging.getLogger('Profiler')
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.profiles = []
+
+	def enable(self):
+		profile = cProfile.Profile()
+		with self.lock:
+			self.profiles.append((threading.current_thread().name, profile))
+		profile.enable()
+
+	def started(self, frame, event, arg):
+		# Installed by threading in every new thread, replaces itself with a profile of that thread
+		sys.setprofile(None)
+		self.enable()
+
+	def start(self):
+		threading.setprofile(self.started)
+		self.enable()
+		return self
+
+	def stop(self):
+		threading.setprofile(None)
+		try:
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+		except EnvironmentError as e:
+			self.LOG.error(u'Cannot write profiles to "{}": '.format(self.path) + str(e))
+			return
+		with self.lock:
+			profiles = list(self.profiles)
+		for i, (name, profile) in enumerate(profiles):
+			profile.create_stats()
+			profile.dump_stats(os.path.join(self.path, '{:03d}-{}.prof'.format(i, name)))
+		self.LOG.info(u'Wrote {} thread profiles to "{}"'.format(len(profiles), self.path))
+
+metrics = Metrics()
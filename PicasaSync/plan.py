@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+import json, threading
+
+class PlanWriter(object):
+	"""Write the actions of a sync plan to a file, one JSON object per line.
+
+	The first line has the kind "options" and holds the options the actions depend on, in "options". Every action has
+	at least the keys "kind" ("album" or "photo"), "op" (the name of the method that runs it), "album", "photo",
+	"reason" and "bytes" (an estimate of the data to transfer), plus whatever is needed to run it again without
+	scanning. Actions refer to their albums by title, and every album is described once, in a line of kind
+	"album_entry" with its "title" and "entry" written before the first action referring to it.
+	"""
+	def __init__(self, path, options):
+		self.f = open(path, 'w')
+		self.f.write(json.dumps({'kind': 'options', 'options': options}, sort_keys = True) + '\n')
+		self.lock = threading.Lock()
+		self.albums = set()
+		self.count = 0
+		self.bytes = 0
+
+	def addAlbum(self, album):
+		"""Describe album, unless it already was."""
+		with self.lock:
+			if album.title in self.albums:
+				return
+			self.albums.add(album.title)
+			self.f.write(json.dumps({'kind': 'album_entry', 'title': album.title, 'entry': album.describe()}, sort_keys = True) + '\n')
+
+	def add(self, action):
+		line = json.dumps(action, sort_keys = True)
+		with self.lock:
+			self.f.write(line + '\n')
+			self.count += 1
+			self.bytes += action['bytes']
+
+	def close(self):
+		self.f.close()
+
+def plan_options(path):
+	"""Return the options the plan in path was written with, or None if it does not have them."""
+	with open(path) as f:
+		header = json.loads(f.readline() or 'null')
+	if not isinstance(header, dict) or header.get('kind') != 'options':
+		return None
+	return header['options']
+
+def read_plan(path):
+	with open(path) as f:
+		for line in f:
+			if line.strip():
+				action = json.loads(line)
+				if action['kind'] != 'options':
+					yield action
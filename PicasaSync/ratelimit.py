@@ -0,0 +1,175 @@
+#! /usr/bin/env python
+
+import logging, threading, time, random, re, socket, httplib, urlparse, collections, cStringIO
+
+from metrics import metrics
+
+class RateLimiter(object):
+	"""Token bucket whose rate adapts to the server.
+
+	The rate is halved every time the server throttles a request, down to MIN_RATE, and grows back by about one
+	request per second for every second of successful requests, up to the configured rate.
+	"""
+	MIN_RATE = 0.5
+
+	def __init__(self, rate):
+		self.max_rate = float(rate)
+		self.rate = self.max_rate
+		self.tokens = max(self.rate, 1.0)
+		self.last = time.time()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self.lock:
+				now = time.time()
+				self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.last) * self.rate)
+				self.last = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+	def throttled(self):
+		with self.lock:
+			self.rate = max(self.MIN_RATE, self.rate / 2)
+
+	def succeeded(self):
+		with self.lock:
+			self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+class RetryBudget(object):
+	"""Allow retries only while they stay under a fraction of the successful requests, so a server that keeps failing
+	is not flooded with them."""
+	def __init__(self, ratio = 0.1, reserve = 10):
+		self.ratio = ratio
+		self.reserve = reserve
+		self.tokens = float(reserve)
+		self.lock = threading.Lock()
+
+	def succeeded(self):
+		with self.lock:
+			self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+	def withdraw(self):
+		with self.lock:
+			if self.tokens < 1:
+				return False
+			self.tokens -= 1
+			return True
+
+class EndpointStats(object):
+	def __init__(self):
+		self.requests = 0
+		self.retries = 0
+		self.throttled = 0
+		self.failures = 0
+		self.seconds = 0.0
+
+def rewind(data):
+	"""Seek back to the start the files in the body of a request, so it can be sent again."""
+	for part in (data if isinstance(data, list) else [data]):
+		handle = getattr(part, 'file_handle', part)
+		if hasattr(handle, 'seek'):
+			handle.seek(0)
+
+class RequestLayer(object):
+	"""Send the HTTP requests of every GData client through a shared rate limiter, retrying the failed ones.
+
+	Throttled (429, 503, and 403 when it reports an exceeded quota or rate limit) and server error responses are
+	retried with exponential backoff and full jitter while the retry budget allows it. Server and connection errors are
+	only retried for idempotent requests, since a POST may have been applied by the server, while a throttled POST was
+	turned away and is retried too. Requests are counted per operation and URL path, with the ids in it masked.
+	"""
+	LOG = logging.getLogger('RequestLayer')
+	RETRY_STATUS = frozenset([408, 429, 500, 502, 503, 504])
+	THROTTLE_STATUS = frozenset([429, 503])
+	QUOTA = re.compile(r'quota|rate ?limit', re.I)
+	IDEMPOTENT = frozenset(['GET', 'PUT', 'DELETE', 'HEAD'])
+	BACKOFF = 1.0
+	MAX_BACKOFF = 60.0
+	ID = re.compile(r'/\d+')
+
+	def __init__(self, rate, retries):
+		self.limiter = RateLimiter(rate)
+		self.budget = RetryBudget()
+		self.retries = retries
+		self.lock = threading.Lock()
+		self.stats = collections.defaultdict(EndpointStats)
+
+	def wrap(self, client):
+		send = client.request
+		def request(operation, url, data = None, *args, **kwargs):
+			return self.request(send, operation, url, data, *args, **kwargs)
+		client.request = request
+		return client
+
+	def endpoint(self, operation, url):
+		url = url.to_string() if hasattr(url, 'to_string') else str(url)
+		return '{} {}'.format(operation, self.ID.sub('/*', urlparse.urlsplit(url).path))
+
+	def throttles(self, status, response):
+		"""Check whether the response asks to slow down. Other 403 responses are permission errors."""
+		if status != 403:
+			return status in self.THROTTLE_STATUS
+		# Keep the body readable by the client
+		body = cStringIO.StringIO(response.read())
+		response.read = lambda amt = None: body.read() if amt is None else body.read(amt)
+		return bool(self.QUOTA.search(body.getvalue()))
+
+	def request(self, send, operation, url, data = None, *args, **kwargs):
+		endpoint = self.endpoint(operation, url)
+		attempt = 0
+		while True:
+			self.limiter.acquire()
+			start = time.time()
+			response = error = status = None
+			try:
+				response = send(operation, url, data, *args, **kwargs)
+				status = response.status
+			except (socket.error, httplib.HTTPException) as e:
+				error = e
+			throttled = status is not None and self.throttles(status, response)
+			with self.lock:
+				stats = self.stats[endpoint]
+				stats.requests += 1
+				stats.seconds += time.time() - start
+				if throttled:
+					stats.throttled += 1
+			metrics.count('requests')
+			if throttled:
+				metrics.count('throttled')
+			if status is not None and status not in self.RETRY_STATUS and not throttled:
+				self.limiter.succeeded()
+				self.budget.succeeded()
+				return response
+			if throttled:
+				self.limiter.throttled()
+			retry = throttled or operation in self.IDEMPOTENT
+			if not retry or attempt >= self.retries or not self.budget.withdraw():
+				with self.lock:
+					stats.failures += 1
+				metrics.count('failures')
+				if error:
+					raise error
+				return response
+			if response:
+				response.read()
+			delay = random.uniform(0, min(self.MAX_BACKOFF, self.BACKOFF * 2 ** attempt))
+			attempt += 1
+			with self.lock:
+				stats.retries += 1
+			metrics.count('retries')
+			self.LOG.debug('Retrying {} after {} in {:.1f}s'.format(endpoint, status or error, delay))
+			time.sleep(delay)
+			rewind(data)
+
+	def summary(self):
+		if not self.stats:
+			return
+		lines = ['{:<60} {:>8} {:>8} {:>9} {:>8} {:>9}'.format('Endpoint', 'Requests', 'Retries', 'Throttled', 'Failures', 'Avg (s)')]
+		for endpoint, stats in sorted(self.stats.iteritems()):
+			lines.append('{:<60} {:>8} {:>8} {:>9} {:>8} {:>9.3f}'.format(endpoint, stats.requests, stats.retries, stats.throttled, stats.failures, stats.seconds / stats.requests))
+		lines.append('Request rate ended at {:.1f}/s'.format(self.limiter.rate))
+		self.LOG.info('Requests per endpoint:\n' + '\n'.join(lines))
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+
+import logging, os, sqlite3, threading, collections, hashlib
+
+from filedate import FilenameDates
+
+StateRecord = collections.namedtuple('StateRecord', 'path size mtime inode origin timestamp mimetype picasa_id picasa_timestamp fingerprint')
+
+def fingerprint(path, block = 1 << 18):
+	"""Fast content hash of a file: its size and the first and last blocks."""
+	with open(path, 'rb') as f:
+		size = os.fstat(f.fileno()).st_size
+		digest = hashlib.sha1(str(size))
+		digest.update(f.read(block))
+		if size > block:
+			f.seek(max(block, size - block))
+			digest.update(f.read(block))
+	return digest.hexdigest()
+
+class StateDB(object):
+	LOG = logging.getLogger('StateDB')
+	FILENAME = '.picasasync.db'
+	COMMIT_EVERY = 1000
+	SCHEMA = (
+		'CREATE TABLE IF NOT EXISTS photos (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, inode INTEGER, origin TEXT, timestamp INTEGER, mimetype TEXT, picasa_id TEXT, picasa_timestamp INTEGER, fingerprint TEXT)',
+		'CREATE TABLE IF NOT EXISTS albums (id TEXT PRIMARY KEY, updated TEXT)',
+		'CREATE TABLE IF NOT EXISTS album_entries (album_id TEXT, position INTEGER, entry BLOB, PRIMARY KEY (album_id, position))',
+	)
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.pending = 0
+		self.db = sqlite3.connect(path, check_same_thread = False)
+		self.db.text_factory = unicode
+		with self.lock:
+			for statement in self.SCHEMA:
+				self.db.execute(statement)
+			if 'fingerprint' not in [column[1] for column in self.db.execute('PRAGMA table_info(photos)')]:
+				self.db.execute('ALTER TABLE photos ADD COLUMN fingerprint TEXT')
+			self.db.commit()
+
+	# Versions of the timestamp origins, part of the key of the cached timestamps
+	ORIGIN_VERSIONS = {'filename': FilenameDates.VERSION}
+
+	@classmethod
+	def _origin(cls, origin):
+		return ','.join(o + ':{}'.format(cls.ORIGIN_VERSIONS[o]) if o in cls.ORIGIN_VERSIONS else o for o in origin)
+
+	def _changed(self):
+		self.pending += 1
+		if self.pending >= self.COMMIT_EVERY:
+			self.db.commit()
+			self.pending = 0
+
+	def lookup(self, path, st, origin):
+		path = os.path.abspath(path)
+		with self.lock:
+			row = self.db.execute('SELECT path, size, mtime, inode, origin, timestamp, mimetype, picasa_id, picasa_timestamp, fingerprint FROM photos WHERE path = ?', (path,)).fetchone()
+		if not row:
+			return None
+		record = StateRecord(*row)
+		if (record.size, record.mtime, record.inode, record.origin) != (st.st_size, st.st_mtime, st.st_ino, self._origin(origin)):
+			return None
+		return record
+
+	def store(self, path, st, origin, timestamp, mimetype):
+		path = os.path.abspath(path)
+		# The remote side is only known to be in sync with this exact file, so a new stat tuple forgets it
+		with self.lock:
+			self.db.execute('INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, NULL)', (path, st.st_size, st.st_mtime, st.st_ino, self._origin(origin), timestamp, mimetype))
+			self._changed()
+
+	def markSynced(self, path, st, picasa_id, picasa_timestamp):
+		path = os.path.abspath(path)
+		with self.lock:
+			self.db.execute('UPDATE photos SET size = ?, mtime = ?, inode = ?, picasa_id = ?, picasa_timestamp = ? WHERE path = ?', (st.st_size, st.st_mtime, st.st_ino, picasa_id, picasa_timestamp, path))
+			self._changed()
+
+	def storeFingerprint(self, path, size, mtime, inode, fingerprint):
+		path = os.path.abspath(path)
+		with self.lock:
+			self.db.execute('UPDATE photos SET fingerprint = ? WHERE path = ? AND size = ? AND mtime = ? AND inode = ?', (fingerprint, path, size, mtime, inode))
+			self._changed()
+
+	def forget(self, path):
+		path = os.path.abspath(path)
+		with self.lock:
+			self.db.execute('DELETE FROM photos WHERE path = ?', (path,))
+			self._changed()
+
+	def forgetPicasa(self, picasa_id):
+		"""Forget every path stored as synced to the Picasa photo picasa_id."""
+		with self.lock:
+			self.db.execute('DELETE FROM photos WHERE picasa_id = ?', (picasa_id,))
+			self._changed()
+
+	def synced(self):
+		"""Return the set of paths of the photos known to be in Picasa."""
+		with self.lock:
+			return set(path for (path,) in self.db.execute('SELECT path FROM photos WHERE picasa_id IS NOT NULL'))
+
+	def cachedAlbum(self, album_id, updated):
+		with self.lock:
+			row = self.db.execute('SELECT updated FROM albums WHERE id = ?', (album_id,)).fetchone()
+			if not row or row[0] != updated:
+				return None
+			return [str(entry) for (entry,) in self.db.execute('SELECT entry FROM album_entries WHERE album_id = ? ORDER BY position', (album_id,))]
+
+	def storeAlbum(self, album_id, updated, entries):
+		with self.lock:
+			self.db.execute('DELETE FROM album_entries WHERE album_id = ?', (album_id,))
+			self.db.executemany('INSERT INTO album_entries VALUES (?, ?, ?)', ((album_id, i, sqlite3.Binary(entry)) for i, entry in enumerate(entries)))
+			self.db.execute('INSERT OR REPLACE INTO albums VALUES (?, ?)', (album_id, updated))
+			self.db.commit()
+			self.pending = 0
+
+	def forgetAlbum(self, album_id):
+		with self.lock:
+			self.db.execute('DELETE FROM album_entries WHERE album_id = ?', (album_id,))
+			self.db.execute('DELETE FROM albums WHERE id = ?', (album_id,))
+			self._changed()
+
+	def clear(self):
+		with self.lock:
+			self.db.execute('DELETE FROM photos')
+			self.db.execute('DELETE FROM album_entries')
+			self.db.execute('DELETE FROM albums')
+			self.db.commit()
+			self.pending = 0
+
+	def verify(self, origin, probe):
+		checked = stale = wrong = 0
+		with self.lock:
+			records = [StateRecord(*row) for row in self.db.execute('SELECT path, size, mtime, inode, origin, timestamp, mimetype, picasa_id, picasa_timestamp, fingerprint FROM photos')]
+		for record in records:
+			checked += 1
+			try:
+				st = os.stat(record.path)
+			except EnvironmentError:
+				st = None
+			if not st or (record.size, record.mtime, record.inode) != (st.st_size, st.st_mtime, st.st_ino):
+				self.LOG.info(u'Forgetting stale entry for "{}"'.format(record.path))
+				self.forget(record.path)
+				stale += 1
+				continue
+			if record.origin != self._origin(origin):
+				continue
+			timestamp = probe(record.path)
+			if timestamp != record.timestamp:
+				self.LOG.warn(u'Wrong timestamp cached for "{}" ({} instead of {})'.format(record.path, record.timestamp, timestamp))
+				self.store(record.path, st, origin, timestamp, record.mimetype)
+				wrong += 1
+		self.commit()
+		return checked, stale, wrong
+
+	def commit(self):
+		with self.lock:
+			self.db.commit()
+			self.pending = 0
+
+	def close(self):
+		with self.lock:
+			self.db.commit()
+			self.db.close()
@@ -0,0 +1,355 @@
+#! /usr/bin/env python
+
+import logging, os, time, mimetypes, multiprocessing, threading, Queue, cStringIO, hashlib, tempfile, subprocess, distutils.spawn, math
+
+from lazy import pyexiv2, Image
+from exif import ExifError, strip_metadata, metadata_segments, reset_orientation, insert_metadata
+from metrics import metrics
+
+# Names of the Image transpositions, so Image is not imported until a photo is transformed
+ORIENTATION_TRANSFORMS = {
+		1 : (),
+		2 : ('FLIP_LEFT_RIGHT',),
+		3 : ('ROTATE_180',),
+		4 : ('FLIP_TOP_BOTTOM',),
+		5 : ('ROTATE_90', 'FLIP_TOP_BOTTOM'),
+		6 : ('ROTATE_270',),
+		7 : ('ROTATE_90', 'FLIP_LEFT_RIGHT'),
+		8 : ('ROTATE_90',)
+		}
+
+# The same transforms as jpegtran arguments
+JPEGTRAN_TRANSFORMS = {
+		2 : ('-flip', 'horizontal'),
+		3 : ('-rotate', '180'),
+		4 : ('-flip', 'vertical'),
+		5 : ('-transpose',),
+		6 : ('-rotate', '90'),
+		7 : ('-transverse',),
+		8 : ('-rotate', '270'),
+		}
+
+class TransformError(Exception): pass
+
+class TransformCache(object):
+	"""Directory of transformed photos, evicted in least recently used order when it grows over max_bytes.
+
+	Entries are keyed by the stat of the source file and the transform parameters, so they are shared by every process
+	using the same directory. Each entry holds the mimetype in its first line, empty when it is unknown, followed by the
+	data. The transform workers get their own copies of the cache, so the size written is accounted for with added() in
+	the parent process, which does the eviction.
+	"""
+	LOG = logging.getLogger('TransformCache')
+	VERSION = 1
+
+	def __init__(self, directory, max_bytes):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.written = 0
+		self.lock = threading.Lock()
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.evict()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['lock']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
+
+	def key(self, path, *params):
+		st = os.stat(path)
+		return hashlib.sha1(repr((self.VERSION, os.path.abspath(path), st.st_size, st.st_mtime, st.st_ino) + params)).hexdigest()
+
+	def get(self, key):
+		entry = os.path.join(self.directory, key)
+		try:
+			with open(entry, 'rb') as f:
+				mimetype = f.readline().rstrip('\n') or None
+				data = f.read()
+			os.utime(entry, None)
+		except EnvironmentError:
+			return None
+		return data, mimetype
+
+	def put(self, key, data, mimetype):
+		tmpfilename = None
+		try:
+			fd, tmpfilename = tempfile.mkstemp(prefix = key, suffix = '.part', dir = self.directory)
+			with os.fdopen(fd, 'wb') as f:
+				f.write((mimetype or '') + '\n')
+				f.write(data)
+			os.rename(tmpfilename, os.path.join(self.directory, key))
+		except EnvironmentError as e:
+			self.LOG.warn('Cannot write transform cache entry: ' + str(e))
+			if tmpfilename:
+				try:
+					os.remove(tmpfilename)
+				except EnvironmentError:
+					pass
+
+	def added(self, size):
+		"""Account for a transformed photo of size bytes, evicting entries once a fair share of max_bytes was added.
+
+		Cache hits are counted too, which only makes the eviction run a bit more often.
+		"""
+		# Scanning the directory is costly, so only do it after writing a fair share of its size
+		with self.lock:
+			self.written += size
+			if self.written <= self.max_bytes / 10:
+				return
+			self.written = 0
+		self.evict()
+
+	def evict(self):
+		entries = []
+		for name in os.listdir(self.directory):
+			try:
+				st = os.stat(os.path.join(self.directory, name))
+			except EnvironmentError:
+				continue
+			entries.append((st.st_mtime, st.st_size, name))
+		total = sum(size for (mtime, size, name) in entries)
+		for mtime, size, name in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			try:
+				os.remove(os.path.join(self.directory, name))
+			except EnvironmentError:
+				pass
+			total -= size
+
+_jpegtran = []
+
+def jpegtran():
+	"""Return the path of the jpegtran command, or None if it is not installed."""
+	if not _jpegtran:
+		_jpegtran.append(distutils.spawn.find_executable('jpegtran'))
+	return _jpegtran[0]
+
+def lossless_rotate(data, orientation):
+	"""Undo the EXIF orientation of the JPEG data by moving its DCT blocks with jpegtran, without decoding it.
+
+	The metadata is dropped. None is returned when jpegtran is not installed or cannot transform the image exactly,
+	which happens when its size is not a multiple of the block size.
+	"""
+	if orientation not in JPEGTRAN_TRANSFORMS or not jpegtran():
+		return None
+	try:
+		process = subprocess.Popen([jpegtran(), '-copy', 'none', '-perfect'] + list(JPEGTRAN_TRANSFORMS[orientation]), stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+		rotated, errors = process.communicate(data)
+	except EnvironmentError:
+		return None
+	if process.returncode != 0 or not rotated:
+		return None
+	return rotated
+
+def open_scaled(photo, max_size):
+	"""Open the image in photo to be resized to fit in max_size.
+
+	A JPEG is decoded at the smallest of its DCT scales (1/2, 1/4 or 1/8) that is still at least as big as the resized
+	image, so the final filter has full quality input while most of the decoding is skipped.
+	"""
+	image = Image.open(photo)
+	width, height = image.size
+	scale = min(float(max_size[0]) / width, float(max_size[1]) / height)
+	if scale < 1:
+		image.draft('RGB', (int(math.ceil(width * scale)), int(math.ceil(height * scale))))
+	return image
+
+def choose_preview(previews, max_size, standard_types):
+	"""Return the smallest preview of a raw file that still fills max_size, or else the biggest one."""
+	previews = sorted((p for p in previews if p.mime_type in standard_types), key = lambda p: p.dimensions[0] * p.dimensions[1])
+	if not previews:
+		return None
+	return next((p for p in previews if p.dimensions[0] >= max_size[0] or p.dimensions[1] >= max_size[1]), previews[-1])
+
+def transform_photo(path, transforms, max_size, strip_exif, raw, standard_types, cache = None):
+	"""Return the data to upload for the photo in path and its mimetype.
+
+	The data is None when the file can be sent untouched, or else a string with the contents to send.
+	This runs in the transform worker processes, so it must only take and return picklable values.
+	"""
+	if cache and (transforms or strip_exif):
+		try:
+			key = cache.key(path, tuple(transforms or ()), tuple(max_size), strip_exif, raw)
+		except EnvironmentError as e:
+			raise TransformError(u'Error reading file "{}": '.format(path) + str(e))
+		cached = cache.get(key)
+		if cached:
+			return cached
+		data, mimetype = transform_photo(path, transforms, max_size, strip_exif, raw, standard_types)
+		# Photos that need no transform are sent from their file, so there is nothing to cache
+		if data is not None:
+			cache.put(key, data, mimetype)
+		return data, mimetype
+
+	mimetype = mimetypes.guess_type(path)[0]
+	transforms = transforms[:] if transforms else []
+	if transforms:
+		original = pyexiv2.ImageMetadata(path)
+		try:
+			original.read()
+		except Exception as e:
+			raise TransformError(u'Error reading file "{}": '.format(path) + str(e))
+
+		if 'raw' in transforms and not raw:
+			transforms.remove('raw')
+		if 'resize' in transforms and not (original.dimensions[0] > max_size[0] or original.dimensions[1] > max_size[1]):
+			transforms.remove('resize')
+		if 'rotate' in transforms and ('Exif.Image.Orientation' not in original or original['Exif.Image.Orientation'].value == 1):
+			transforms.remove('rotate')
+
+	if not transforms:
+		if not strip_exif:
+			return None, mimetype
+		try:
+			with open(path, 'rb') as f:
+				return strip_metadata(f), mimetype
+		except ExifError:
+			pass
+		except EnvironmentError as e:
+			raise TransformError(u'Error reading file "{}": '.format(path) + str(e))
+		# Not a JPEG file
+		original = pyexiv2.ImageMetadata.from_buffer(file(path).read())
+		original.read()
+		for k in original.exif_keys + original.iptc_keys + original.xmp_keys:
+			del original[k]
+		del original.comment
+		original.write()
+		return original.buffer, mimetype
+
+	rotated = False
+	if 'raw' in transforms:
+		preview = choose_preview(original.previews, max_size, standard_types)
+		if not preview:
+			raise TransformError(u'Error getting valid preview from raw file "{}"'.format(path))
+		mimetype = preview.mime_type
+		# The preview is sent as it is when it already fits
+		if 'resize' in transforms and not (preview.dimensions[0] > max_size[0] or preview.dimensions[1] > max_size[1]):
+			transforms.remove('resize')
+		data = preview.data
+	else:
+		data = original.buffer
+	if 'rotate' in transforms and 'resize' not in transforms and mimetype == 'image/jpeg':
+		lossless = lossless_rotate(data, original['Exif.Image.Orientation'].value)
+		if lossless is not None:
+			transforms.remove('rotate')
+			rotated = True
+			data = lossless
+	if 'resize' in transforms or 'rotate' in transforms:
+		if 'resize' in transforms:
+			image = open_scaled(cStringIO.StringIO(data), max_size)
+			image.thumbnail(max_size, Image.ANTIALIAS)
+		else:
+			image = Image.open(cStringIO.StringIO(data))
+		if 'rotate' in transforms:
+			for t in ORIENTATION_TRANSFORMS.get(original['Exif.Image.Orientation'].value, ()):
+				image = image.transpose(getattr(Image, t))
+			rotated = True
+		photo = cStringIO.StringIO()
+		# TODO: save in the same format and size approx
+		image.save(photo, 'JPEG', quality = 95)
+		mimetype = 'image/jpeg'
+		data = photo.getvalue()
+	if not strip_exif:
+		# Splice the metadata segments of a JPEG original into the output as they are, instead of parsing the output
+		# to copy the metadata with exiv2
+		segments = None
+		if not raw and mimetype == 'image/jpeg' and mimetypes.guess_type(path)[0] == 'image/jpeg':
+			try:
+				with open(path, 'rb') as f:
+					segments = metadata_segments(f)
+			except (ExifError, EnvironmentError):
+				pass
+		if segments is not None:
+			if rotated:
+				segments = [reset_orientation(segment) for segment in segments]
+			data = insert_metadata(data, segments)
+		else:
+			if rotated:
+				original['Exif.Image.Orientation'] = 1
+			modified = pyexiv2.ImageMetadata.from_buffer(data)
+			modified.read()
+			original.copy(modified)
+			modified.write()
+			data = modified.buffer
+	return data, mimetype
+
+def timed_transform_photo(*args):
+	"""Run transform_photo in a worker process, returning its result and the seconds it took."""
+	start = time.time()
+	result = transform_photo(*args)
+	return result, time.time() - start
+
+class TransformPipeline(object):
+	"""Transform photos in a pool of processes and upload the results from a separate set of threads.
+
+	A semaphore bounds the number of photos between both stages, so the transformed buffers held in memory do not grow
+	when the uploads are slower than the transforms.
+	"""
+	LOG = logging.getLogger('TransformPipeline')
+
+	def __init__(self, clients, transform_workers, upload_workers, queue_size = None):
+		self.clients = clients
+		self.pool = multiprocessing.Pool(transform_workers)
+		self.slots = threading.BoundedSemaphore(queue_size or transform_workers + upload_workers)
+		self.queue = Queue.Queue()
+		self.threads = []
+		for i in xrange(upload_workers):
+			thread = threading.Thread(target = self.uploader)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def submit(self, photo, args, reserved = 0):
+		"""Transform and upload photo, which holds reserved bytes of the in-flight budget until it is sent."""
+		self.slots.acquire()
+		self.queue.put((photo, self.pool.apply_async(timed_transform_photo, args), reserved))
+		metrics.gauge('upload_queue', self.queue.qsize())
+
+	def uploader(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				photo, result, reserved = item
+				try:
+					(data, mimetype), seconds = result.get()
+				except TransformError as e:
+					photo.release(reserved)
+					photo.LOG.error(unicode(e))
+					continue
+				except Exception:
+					photo.release(reserved)
+					raise
+				metrics.record('transform', seconds)
+				if data is not None and photo.album.cl_args.transform_cache:
+					photo.album.cl_args.transform_cache.added(len(data))
+				with self.clients.checkout():
+					photo.send(photo.path if data is None else cStringIO.StringIO(data), mimetype, reserved)
+			except Exception:
+				self.LOG.exception('Error uploading photo')
+			finally:
+				if item is not None:
+					self.slots.release()
+				self.queue.task_done()
+
+	def join(self):
+		with self.queue.all_tasks_done:
+			while self.queue.unfinished_tasks:
+				self.queue.all_tasks_done.wait(0.5)
+		for thread in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+		self.pool.close()
+		self.pool.join()
+
+	def close(self):
+		self.pool.terminate()
@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+
+import logging, threading, Queue, itertools, contextlib
+
+from metrics import metrics
+
+class ClientPool(object):
+	"""Lend GData clients to threads, creating them with factory only when every client made so far is busy, up to
+	size clients.
+
+	Inside a session a thread gets a client the first time it asks for the current one, and gives it back when the
+	session ends, so tasks that do not talk to Picasa do not hold or create clients.
+	"""
+	def __init__(self, factory, size):
+		self.factory = factory
+		self.size = size
+		self.created = 0
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.clients = Queue.Queue()
+
+	@apply
+	def current():
+		def fget(self):
+			client = getattr(self.local, 'client', None)
+			if client is None and getattr(self.local, 'session', False):
+				client = self.local.client = self.get()
+			return client
+		return property(**locals())
+
+	def get(self):
+		try:
+			return self.clients.get_nowait()
+		except Queue.Empty:
+			pass
+		with self.lock:
+			create = self.created < self.size
+			if create:
+				self.created += 1
+		if not create:
+			return self.clients.get()
+		try:
+			return self.factory()
+		except Exception:
+			with self.lock:
+				self.created -= 1
+			raise
+
+	def put(self, client):
+		self.clients.put(client)
+
+	@contextlib.contextmanager
+	def session(self):
+		if getattr(self.local, 'session', False):
+			yield
+			return
+		self.local.session = True
+		try:
+			yield
+		finally:
+			self.local.session = False
+			client = getattr(self.local, 'client', None)
+			if client is not None:
+				self.local.client = None
+				self.put(client)
+
+	@contextlib.contextmanager
+	def checkout(self):
+		if self.current is not None:
+			yield self.current
+			return
+		client = self.get()
+		self.local.client = client
+		try:
+			yield client
+		finally:
+			self.local.client = None
+			self.put(client)
+
+class ByteBudget(object):
+	"""Block callers while the bytes they hold would go over the limit.
+
+	A single request bigger than the limit is let through when nothing else is held, so it cannot wait forever.
+	"""
+	def __init__(self, limit):
+		self.limit = limit
+		self.used = 0
+		self.condition = threading.Condition()
+
+	def acquire(self, size):
+		with self.condition:
+			while self.used and self.used + size > self.limit:
+				self.condition.wait()
+			self.used += size
+
+	def release(self, size):
+		with self.condition:
+			self.used -= size
+			self.condition.notify_all()
+
+class TaskGroup(object):
+	"""Count the tasks wrapped for one job and call callback once the last of them has finished.
+
+	The submitter holds the group open until close(), so the job does not end while its tasks are still being
+	submitted, whether they run inline or in other threads.
+	"""
+	def __init__(self, callback):
+		self.callback = callback
+		self.lock = threading.Lock()
+		self.pending = 1
+
+	def wrap(self, task):
+		with self.lock:
+			self.pending += 1
+		def run(*args, **kwargs):
+			try:
+				return task(*args, **kwargs)
+			finally:
+				self.done()
+		return run
+
+	def close(self):
+		self.done()
+
+	def done(self):
+		with self.lock:
+			self.pending -= 1
+			if self.pending:
+				return
+		self.callback()
+
+class WorkQueue(object):
+	LOG = logging.getLogger('WorkQueue')
+	PHOTO_PRIORITY = 0
+	ALBUM_PRIORITY = 1
+
+	def __init__(self, clients, workers = 1):
+		self.clients = clients
+		self.tasks = Queue.PriorityQueue()
+		self.sequence = itertools.count()
+		self.done = threading.Condition()
+		self.threads = []
+		# With a single worker tasks run inline, in the order they are submitted
+		if workers > 1:
+			for i in xrange(workers):
+				thread = threading.Thread(target = self.worker)
+				thread.daemon = True
+				thread.start()
+				self.threads.append(thread)
+
+	@apply
+	def client():
+		def fget(self):
+			return self.clients.current
+		return property(**locals())
+
+	def run(self, task, args, kwargs):
+		with self.clients.session():
+			return task(*args, **kwargs)
+
+	def submit(self, task, *args, **kwargs):
+		priority = kwargs.pop('priority', self.PHOTO_PRIORITY)
+		if not self.threads:
+			return self.run(task, args, kwargs)
+		self.tasks.put((priority, next(self.sequence), task, args, kwargs))
+		metrics.gauge('work_queue', self.tasks.qsize())
+
+	def worker(self):
+		while True:
+			priority, sequence, task, args, kwargs = self.tasks.get()
+			try:
+				if task is None:
+					return
+				self.run(task, args, kwargs)
+			except Exception:
+				self.LOG.exception('Error running task')
+			finally:
+				self.tasks.task_done()
+				with self.done:
+					self.done.notify_all()
+
+	def wait(self, limit = 0):
+		"""Wait until no more than limit tasks are queued or running."""
+		# Wait with a timeout so the main thread stays interruptible
+		with self.done:
+			while self.tasks.unfinished_tasks > limit:
+				self.done.wait(0.5)
+
+	def join(self):
+		if not self.threads:
+			return
+		self.wait()
+		for thread in self.threads:
+			self.tasks.put((self.ALBUM_PRIORITY + 1, next(self.sequence), None, None, None))
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+"""Measure the overhead of the dryrun decorator over a plain method call.
+
+usage: dryrun_overhead.py [-n CALLS] [-o INSTANCES]
+
+Calls are timed with the log message discarded by the level and with it formatted and handled, both running the
+method and in dry run mode. The attributes left on the instances after calling the method are reported too.
+"""
+
+import sys, os, time, logging, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+from dryrun import dryrun
+
+LOG = logging.getLogger('bench')
+LOG.addHandler(logging.NullHandler())
+LOG.propagate = False
+
+class Args(object):
+	dry_run = False
+
+class Photo(object):
+	def __init__(self, cl_args, path):
+		self.cl_args = cl_args
+		self.path = path
+
+	def plain(self):
+		return self.path
+
+	@dryrun('self.cl_args.dry_run', LOG, u'Uploading file "{self.path}"{reason}')
+	def upload(self):
+		return self.path
+
+def timed(function, calls):
+	start = time.time()
+	for i in xrange(calls):
+		function()
+	return (time.time() - start) / calls * 1e6
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark the dryrun decorator')
+	parser.add_argument('-n', '--calls', type = int, default = 200000, help = 'Number of calls of every case')
+	parser.add_argument('-o', '--instances', type = int, default = 10000, help = 'Number of instances to check for leftover attributes')
+	args = parser.parse_args()
+
+	cl_args = Args()
+	photo = Photo(cl_args, u'/photos/album/IMG_0001.jpg')
+	print 'plain call:              {:8.3f} us'.format(timed(photo.plain, args.calls))
+	for dry_run in (False, True):
+		cl_args.dry_run = dry_run
+		for level, name in ((logging.ERROR, 'message discarded'), (logging.DEBUG, 'message formatted')):
+			LOG.setLevel(level)
+			call = lambda: photo.upload(reason = u' because it is not in the album "Album"')
+			print '{:<8} {:<17}: {:8.3f} us'.format('dry run' if dry_run else 'run', name, timed(call, args.calls))
+
+	cl_args.dry_run = False
+	photos = [Photo(cl_args, u'/photos/album/IMG_{:04d}.jpg'.format(i)) for i in xrange(args.instances)]
+	for p in photos:
+		p.upload(reason = u' because it is not in the album "Album"')
+	print 'attributes per instance after the calls: {}'.format(sorted(set(k for p in photos for k in vars(p))))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+"""Compare the fast EXIF DateTime parser with a full pyexiv2 metadata read.
+
+usage: exif_datetime.py [-r ROUNDS] PATH [PATH ...]
+
+Directories are walked for JPEG and NEF files. Both readers are timed over the whole corpus and any file where they
+disagree is reported.
+"""
+
+import sys, os, time, calendar, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+import pyexiv2
+from exif import read_datetimes, ExifError
+
+EXTENSIONS = ('.jpg', '.jpeg', '.nef')
+
+def corpus(paths):
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, files in os.walk(path):
+				for f in sorted(files):
+					if os.path.splitext(f)[1].lower() in EXTENSIONS:
+						yield os.path.join(root, f)
+		else:
+			yield path
+
+def with_pyexiv2(path):
+	metadata = pyexiv2.ImageMetadata(path)
+	try:
+		metadata.read()
+		if 'Exif.Image.DateTime' in metadata:
+			return calendar.timegm(metadata['Exif.Image.DateTime'].value.timetuple())
+	except Exception:
+		pass
+	return None
+
+def with_parser(path):
+	try:
+		return read_datetimes(path).get('DateTime')
+	except (ExifError, EnvironmentError):
+		return with_pyexiv2(path)
+
+def timed(reader, files, rounds):
+	best = None
+	for i in xrange(rounds):
+		start = time.time()
+		results = [reader(f) for f in files]
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, results
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark EXIF DateTime extraction')
+	parser.add_argument('-r', '--rounds', type = int, default = 3, help = 'Rounds per reader, the best one is reported')
+	parser.add_argument('paths', metavar = 'PATH', nargs = '+')
+	args = parser.parse_args()
+
+	files = list(corpus(args.paths))
+	if not files:
+		raise SystemExit('No JPEG or NEF files found')
+	slow, expected = timed(with_pyexiv2, files, args.rounds)
+	fast, results = timed(with_parser, files, args.rounds)
+	for f, a, b in zip(files, expected, results):
+		if a != b:
+			print 'MISMATCH {}: pyexiv2 {} parser {}'.format(f, a, b)
+	print '{} files'.format(len(files))
+	print 'pyexiv2: {:8.3f}s {:10.1f} files/s'.format(slow, len(files) / slow)
+	print 'parser:  {:8.3f}s {:10.1f} files/s'.format(fast, len(files) / fast)
+	print 'speedup: {:8.1f}x'.format(slow / fast)
+
+if __name__ == '__main__':
+	main()
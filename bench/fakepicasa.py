@@ -0,0 +1,372 @@
+#! /usr/bin/env python
+"""Local stand-in for the Picasa Web Albums GData API, to measure syncs without the real service.
+
+usage: fakepicasa.py [-p PORT] [-l SECONDS] [-b BYTES] [-e RATE] [-s SEED]
+
+It serves the album and photo feeds, album creation and deletion, photo entries, uploads, metadata and media updates,
+moves, deletions, batches and media downloads, keeping everything in memory. Every request can be delayed, transfers
+can be limited to a bandwidth, and a fraction of the requests can be answered with 503. Authentication is ignored.
+"""
+
+import sys, time, random, threading, re, urlparse, argparse, BaseHTTPServer, SocketServer
+import xml.etree.cElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+ATOM = 'http://www.w3.org/2005/Atom'
+GPHOTO = 'http://schemas.google.com/photos/2007'
+BATCH = 'http://schemas.google.com/gdata/batch'
+NAMESPACES = "xmlns='{}' xmlns:gphoto='{}' xmlns:batch='{}' xmlns:openSearch='http://a9.com/-/spec/opensearch/1.1/'".format(ATOM, GPHOTO, BATCH)
+KIND = "<category scheme='http://schemas.google.com/g/2005#kind' term='http://schemas.google.com/photos/2007#{}'/>"
+
+USER = r'/data/(?:feed|entry|media)/api/user/[^/?]+'
+ROUTES = (
+	('GET', re.compile(USER + r'/?$'), 'listAlbums'),
+	('POST', re.compile(USER + r'/?$'), 'insertAlbum'),
+	('GET', re.compile(USER + r'/albumid/(\d+)/?$'), 'listPhotos'),
+	('POST', re.compile(USER + r'/albumid/(\d+)/batch$'), 'batch'),
+	('POST', re.compile(USER + r'/albumid/(\d+)/?$'), 'insertPhoto'),
+	('DELETE', re.compile(USER + r'/albumid/(\d+)/?$'), 'deleteAlbum'),
+	('GET', re.compile(r'/data/entry/api/user/[^/]+/albumid/(\d+)/photoid/(\d+)(?:/\d+)?$'), 'getPhoto'),
+	('PUT', re.compile(r'/data/entry/api/user/[^/]+/albumid/(\d+)/photoid/(\d+)(?:/\d+)?$'), 'updatePhoto'),
+	('PUT', re.compile(r'/data/media/api/user/[^/]+/albumid/(\d+)/photoid/(\d+)(?:/\d+)?$'), 'updateMedia'),
+	('DELETE', re.compile(r'/data/entry/api/user/[^/]+/albumid/(\d+)/photoid/(\d+)(?:/\d+)?$'), 'deletePhoto'),
+	('GET', re.compile(r'/media/(\d+)$'), 'download'),
+)
+
+class NotFound(Exception): pass
+
+class Store(object):
+	"""Albums and photos of the fake account, with the request and byte counters."""
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.ids = iter(xrange(1000, sys.maxint))
+		self.clock = iter(xrange(sys.maxint))
+		self.albums = {}
+		self.photos = {}
+		self.requests = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.errors = 0
+
+	def updated(self):
+		# Strictly increasing, so every change is seen by the album feed caches
+		return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1300000000 + next(self.clock))) + '.000Z'
+
+	def album(self, album_id):
+		try:
+			return self.albums[album_id]
+		except KeyError:
+			raise NotFound('album ' + album_id)
+
+	def photo(self, photo_id):
+		try:
+			return self.photos[photo_id]
+		except KeyError:
+			raise NotFound('photo ' + photo_id)
+
+	def touch(self, album_id):
+		self.album(album_id)['updated'] = self.updated()
+
+	def counters(self):
+		with self.lock:
+			return {'requests': self.requests, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out, 'errors': self.errors}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Requests of the fake server. The method of every route returns the arguments of reply() for its response."""
+	protocol_version = 'HTTP/1.1'
+	CHUNK = 1 << 16
+
+	def log_message(self, format, *args):
+		pass
+
+	@property
+	def store(self):
+		return self.server.store
+
+	def base(self):
+		return 'http://' + self.headers.get('Host', '{}:{}'.format(*self.server.server_address))
+
+	def throttle(self, size):
+		if self.server.bandwidth:
+			time.sleep(float(size) / self.server.bandwidth)
+
+	def body(self):
+		length = int(self.headers.get('Content-Length', 0))
+		chunks = []
+		while length > 0:
+			chunk = self.rfile.read(min(length, self.CHUNK))
+			if not chunk:
+				break
+			self.throttle(len(chunk))
+			chunks.append(chunk)
+			length -= len(chunk)
+		data = ''.join(chunks)
+		with self.store.lock:
+			self.store.bytes_in += len(data)
+		return data
+
+	def reply(self, status, data = '', content_type = 'application/atom+xml; charset=UTF-8', headers = ()):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(data)))
+		for header in headers:
+			self.send_header(*header)
+		self.end_headers()
+		if self.command == 'HEAD':
+			return
+		for i in xrange(0, len(data), self.CHUNK):
+			self.wfile.write(data[i:i + self.CHUNK])
+			self.throttle(min(self.CHUNK, len(data) - i))
+		with self.store.lock:
+			self.store.bytes_out += len(data)
+
+	def handle_request(self):
+		url = urlparse.urlsplit(self.path)
+		with self.store.lock:
+			self.store.requests += 1
+		if self.server.latency:
+			time.sleep(self.server.latency)
+		data = self.body() if self.command in ('POST', 'PUT') else ''
+		if self.server.random.random() < self.server.error_rate:
+			with self.store.lock:
+				self.store.errors += 1
+			return self.reply(503, 'Injected error', 'text/plain')
+		for method, pattern, name in ROUTES:
+			m = pattern.match(url.path)
+			if method == self.command and m:
+				try:
+					# Only the response is built under the lock, so it is not held while sending at the limited bandwidth
+					with self.store.lock:
+						response = getattr(self, name)(data, urlparse.parse_qs(url.query), *m.groups())
+				except NotFound as e:
+					response = (404, 'Not found: ' + str(e), 'text/plain')
+				return self.reply(*response)
+		self.reply(404, 'Unknown URL', 'text/plain')
+
+	do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+	def albumXml(self, album, namespaces = True):
+		base = self.base()
+		return (u"<entry {ns}><id>{base}/data/entry/api/user/default/albumid/{id}</id><updated>{updated}</updated>" + KIND.format('album') +
+			u"<title type='text'>{title}</title>"
+			u"<link rel='http://schemas.google.com/g/2005#feed' type='application/atom+xml' href='{base}/data/feed/api/user/default/albumid/{id}'/>"
+			u"<link rel='edit' type='application/atom+xml' href='{base}/data/entry/api/user/default/albumid/{id}'/>"
+			u"<gphoto:id>{id}</gphoto:id><gphoto:name>{id}</gphoto:name><gphoto:access>{access}</gphoto:access><gphoto:user>default</gphoto:user>"
+			u"<gphoto:timestamp>{timestamp}</gphoto:timestamp><gphoto:numphotos>{count}</gphoto:numphotos></entry>").format(
+				ns = NAMESPACES if namespaces else '', base = base, id = album['id'], updated = album['updated'], title = escape(album['title']),
+				access = album['access'], timestamp = album['timestamp'], count = len(album['photos']))
+
+	def photoXml(self, photo, namespaces = True, extra = ''):
+		base = self.base()
+		return (u"<entry {ns}>{extra}<id>{base}/data/entry/api/user/default/albumid/{album}/photoid/{id}</id><updated>{updated}</updated>" + KIND.format('photo') +
+			u"<title type='text'>{title}</title><content type='{type}' src='{base}/media/{id}'/>"
+			u"<link rel='edit' type='application/atom+xml' href='{base}/data/entry/api/user/default/albumid/{album}/photoid/{id}'/>"
+			u"<link rel='edit-media' type='{type}' href='{base}/data/media/api/user/default/albumid/{album}/photoid/{id}'/>"
+			u"<gphoto:id>{id}</gphoto:id><gphoto:albumid>{album}</gphoto:albumid><gphoto:size>{size}</gphoto:size>"
+			u"<gphoto:checksum>{checksum}</gphoto:checksum><gphoto:timestamp>{timestamp}</gphoto:timestamp></entry>").format(
+				ns = NAMESPACES if namespaces else '', extra = extra, base = base, id = photo['id'], album = photo['album'], updated = photo['updated'],
+				title = escape(photo['title']), type = photo['type'], size = len(photo['data']), checksum = escape(photo['checksum']), timestamp = photo['timestamp'])
+
+	def feed(self, title, entries):
+		return (u"<?xml version='1.0' encoding='UTF-8'?><feed {}><id>{}{}</id><updated>{}</updated><title type='text'>{}</title>"
+			u"<openSearch:totalResults>{}</openSearch:totalResults>{}</feed>").format(
+				NAMESPACES, self.base(), escape(self.path), self.store.updated(), escape(title), len(entries), ''.join(entries)).encode('utf-8')
+
+	def entry(self, xml):
+		return (u"<?xml version='1.0' encoding='UTF-8'?>" + xml).encode('utf-8')
+
+	@staticmethod
+	def fields(element):
+		"""Return the title, timestamp, checksum, album id and access given in an entry element, when present."""
+		fields = {}
+		for key, tag in (('title', '{%s}title' % ATOM), ('timestamp', '{%s}timestamp' % GPHOTO), ('checksum', '{%s}checksum' % GPHOTO),
+				('album', '{%s}albumid' % GPHOTO), ('access', '{%s}access' % GPHOTO)):
+			child = element.find(tag)
+			if child is not None and child.text:
+				fields[key] = child.text
+		return fields
+
+	@staticmethod
+	def multipart(data, content_type):
+		"""Split a GData media upload into its entry XML, or None, and the media data with its type."""
+		if not content_type.startswith('multipart/related'):
+			return None, data, content_type
+		boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+		xml = media = None
+		media_type = 'image/jpeg'
+		for part in data.split('--' + boundary)[1:]:
+			if part.startswith('--'):
+				break
+			headers, _, body = part.partition('\r\n\r\n')
+			if body.endswith('\r\n'):
+				body = body[:-2]
+			if 'application/atom+xml' in headers:
+				xml = body
+			else:
+				media = body
+				m = re.search(r'Content-Type:\s*([^\s;]+)', headers, re.I)
+				if m:
+					media_type = m.group(1)
+		return xml, media, media_type
+
+	def listAlbums(self, data, query):
+		entries = [self.albumXml(album, False) for album in sorted(self.store.albums.itervalues(), key = lambda a: a['id'])]
+		return (200, self.feed('default', entries))
+
+	def insertAlbum(self, data, query):
+		fields = self.fields(ElementTree.fromstring(data))
+		album_id = str(next(self.store.ids))
+		album = self.store.albums[album_id] = {'id': album_id, 'title': fields.get('title', album_id), 'access': fields.get('access', 'private'),
+			'timestamp': fields.get('timestamp', str(int(time.time() * 1000))), 'updated': self.store.updated(), 'photos': set()}
+		return (201, self.entry(self.albumXml(album)))
+
+	def listPhotos(self, data, query, album_id):
+		album = self.store.album(album_id)
+		entries = [self.photoXml(self.store.photos[photo_id], False) for photo_id in sorted(album['photos'])]
+		return (200, self.feed(album['title'], entries))
+
+	def deleteAlbum(self, data, query, album_id):
+		album = self.store.albums.pop(album_id, None)
+		if not album:
+			raise NotFound('album ' + album_id)
+		for photo_id in album['photos']:
+			self.store.photos.pop(photo_id, None)
+		return (200,)
+
+	def insertPhoto(self, data, query, album_id):
+		album = self.store.album(album_id)
+		xml, media, media_type = self.multipart(data, self.headers.get('Content-Type', ''))
+		fields = self.fields(ElementTree.fromstring(xml)) if xml else {}
+		photo_id = str(next(self.store.ids))
+		photo = self.store.photos[photo_id] = {'id': photo_id, 'album': album_id, 'title': fields.get('title', self.headers.get('Slug', photo_id)),
+			'type': media_type, 'data': media or '', 'checksum': fields.get('checksum', ''), 'timestamp': fields.get('timestamp', str(int(time.time() * 1000))),
+			'updated': self.store.updated()}
+		album['photos'].add(photo_id)
+		self.store.touch(album_id)
+		return (201, self.entry(self.photoXml(photo)))
+
+	def applyUpdate(self, photo, fields):
+		for key in ('title', 'timestamp', 'checksum'):
+			if key in fields:
+				photo[key] = fields[key]
+		# A new album id moves the photo
+		if fields.get('album', photo['album']) != photo['album']:
+			self.store.album(fields['album'])['photos'].add(photo['id'])
+			self.store.album(photo['album'])['photos'].discard(photo['id'])
+			self.store.touch(photo['album'])
+			photo['album'] = fields['album']
+		photo['updated'] = self.store.updated()
+		self.store.touch(photo['album'])
+
+	def getPhoto(self, data, query, album_id, photo_id):
+		return (200, self.entry(self.photoXml(self.store.photo(photo_id))))
+
+	def updatePhoto(self, data, query, album_id, photo_id):
+		photo = self.store.photo(photo_id)
+		self.applyUpdate(photo, self.fields(ElementTree.fromstring(data)))
+		return (200, self.entry(self.photoXml(photo)))
+
+	def updateMedia(self, data, query, album_id, photo_id):
+		photo = self.store.photo(photo_id)
+		xml, media, media_type = self.multipart(data, self.headers.get('Content-Type', ''))
+		if xml:
+			self.applyUpdate(photo, self.fields(ElementTree.fromstring(xml)))
+		photo['data'] = media or ''
+		photo['type'] = media_type
+		photo['updated'] = self.store.updated()
+		self.store.touch(photo['album'])
+		return (200, self.entry(self.photoXml(photo)))
+
+	def deletePhoto(self, data, query, album_id, photo_id):
+		photo = self.store.photos.pop(photo_id, None)
+		if not photo:
+			raise NotFound('photo ' + photo_id)
+		self.store.album(photo['album'])['photos'].discard(photo_id)
+		self.store.touch(photo['album'])
+		return (200,)
+
+	def batch(self, data, query, album_id):
+		entries = []
+		for element in ElementTree.fromstring(data).findall('{%s}entry' % ATOM):
+			batch_id = element.findtext('{%s}id' % BATCH, '')
+			operation = element.find('{%s}operation' % BATCH)
+			operation = operation.get('type') if operation is not None else 'insert'
+			entry_id = element.findtext('{%s}id' % ATOM, '')
+			m = re.search(r'/photoid/(\d+)', entry_id)
+			tags = u"<batch:id>{}</batch:id><batch:operation type='{}'/>".format(escape(batch_id), operation)
+			photo = self.store.photos.get(m.group(1)) if m else None
+			if not photo:
+				entries.append(u"<entry>{}<batch:status code='404' reason='Not found'/><id>{}</id></entry>".format(tags, escape(entry_id)))
+			elif operation == 'delete':
+				self.store.photos.pop(photo['id'])
+				self.store.album(photo['album'])['photos'].discard(photo['id'])
+				self.store.touch(photo['album'])
+				entries.append(u"<entry>{}<batch:status code='200' reason='Success'/><id>{}</id></entry>".format(tags, escape(entry_id)))
+			elif operation == 'query':
+				entries.append(self.photoXml(photo, False, tags + u"<batch:status code='200' reason='Success'/>"))
+			elif operation == 'update':
+				self.applyUpdate(photo, self.fields(element))
+				entries.append(self.photoXml(photo, False, tags + u"<batch:status code='200' reason='Success'/>"))
+			else:
+				entries.append(u"<entry>{}<batch:status code='400' reason='Unsupported operation'/><id>{}</id></entry>".format(tags, escape(entry_id)))
+		return (200, self.feed('batch', entries))
+
+	def download(self, data, query, photo_id):
+		photo = self.store.photo(photo_id)
+		content = photo['data']
+		etag = '"{}-{}"'.format(photo['id'], photo['updated'])
+		m = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+		# A Range with a stale If-Range gets the whole photo
+		if m and self.headers.get('If-Range', etag) == etag:
+			start = int(m.group(1))
+			if start >= len(content):
+				return (416, '', 'text/plain')
+			return (206, content[start:], photo['type'], [('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content))), ('ETag', etag)])
+		return (200, content, photo['type'], [('ETag', etag)])
+
+class FakePicasa(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address = ('127.0.0.1', 0), latency = 0.0, bandwidth = 0, error_rate = 0.0, seed = 0):
+		BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+		self.store = Store()
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.error_rate = error_rate
+		self.random = random.Random(seed)
+
+	@property
+	def url(self):
+		return 'http://{}:{}'.format(*self.server_address)
+
+	def start(self):
+		thread = threading.Thread(target = self.serve_forever)
+		thread.daemon = True
+		thread.start()
+		return self
+
+def _parse_size(arg):
+	units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+	if arg[-1:].upper() in units:
+		return int(arg[:-1]) * units[arg[-1:].upper()]
+	return int(arg)
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Fake Picasa Web Albums server')
+	parser.add_argument('-p', '--port', type = int, default = 8080)
+	parser.add_argument('-l', '--latency', type = float, default = 0.0, help = 'Seconds added to every request')
+	parser.add_argument('-b', '--bandwidth', type = _parse_size, default = 0, help = 'Bytes per second of every transfer (K, M or G suffixes allowed), 0 for no limit')
+	parser.add_argument('-e', '--error-rate', type = float, default = 0.0, help = 'Fraction of the requests answered with 503')
+	parser.add_argument('-s', '--seed', type = int, default = 0)
+	args = parser.parse_args()
+
+	server = FakePicasa(('127.0.0.1', args.port), args.latency, args.bandwidth, args.error_rate, args.seed)
+	print 'Serving on {}'.format(server.url)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+"""Compare the filename timestamp engine with the old per-digit dateutil probing.
+
+usage: filename_dates.py [-n NAMES] [-s SEED]
+
+A synthetic directory of NAMES file names is generated, mixing phone, camera and date prefixed naming schemes.
+"""
+
+import sys, os, time, calendar, random, datetime, re, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+import dateutil.parser
+from filedate import FilenameDates
+
+SCHEMES = (
+	lambda d, i: 'IMG_{:%Y%m%d_%H%M%S}.jpg'.format(d),
+	lambda d, i: 'VID_{:%Y%m%d_%H%M%S}.jpg'.format(d),
+	lambda d, i: '{:%Y-%m-%d %H.%M.%S}.jpg'.format(d),
+	lambda d, i: '{:%Y-%m-%d} holidays {:04d}.jpg'.format(d, i),
+	lambda d, i: '{:%d.%m.%Y} {:03d}.jpg'.format(d, i),
+	lambda d, i: 'DSC_{:04d}.JPG'.format(i % 10000),
+)
+
+def names(count, seed):
+	rng = random.Random(seed)
+	start = datetime.datetime(2005, 1, 1)
+	return [rng.choice(SCHEMES)(start + datetime.timedelta(seconds = rng.randint(0, 10 * 365 * 86400)), i) for i in xrange(count)]
+
+def old(name):
+	for m in re.finditer(r'\d', name):
+		try:
+			return calendar.timegm(dateutil.parser.parse(m.string[m.start():], fuzzy = True, dayfirst = True).timetuple())
+		except ValueError:
+			pass
+	return None
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark filename timestamp parsing')
+	parser.add_argument('-n', '--names', type = int, default = 100000, help = 'Number of names in the synthetic directory')
+	parser.add_argument('-s', '--seed', type = int, default = 0)
+	args = parser.parse_args()
+
+	directory = names(args.names, args.seed)
+	start = time.time()
+	expected = [old(name) for name in directory]
+	slow = time.time() - start
+	engine = FilenameDates()
+	start = time.time()
+	results = [engine.timestamp(name) for name in directory]
+	fast = time.time() - start
+	start = time.time()
+	[engine.timestamp(name) for name in directory]
+	cached = time.time() - start
+
+	differ = sum(1 for (a, b) in zip(expected, results) if a != b)
+	print '{} names, {} with a different result'.format(len(directory), differ)
+	print 'dateutil: {:8.3f}s {:10.1f} names/s'.format(slow, len(directory) / slow)
+	print 'engine:   {:8.3f}s {:10.1f} names/s'.format(fast, len(directory) / fast)
+	print 'cached:   {:8.3f}s {:10.1f} names/s'.format(cached, len(directory) / cached)
+	print 'speedup:  {:8.1f}x'.format(slow / fast)
+
+if __name__ == '__main__':
+	main()
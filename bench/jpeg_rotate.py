@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+"""Compare the lossless jpegtran rotation with decoding, transposing and encoding again with PIL.
+
+usage: jpeg_rotate.py [-n IMAGES] [-s WIDTHxHEIGHT] [-o ORIENTATION] [PATH ...]
+
+Without PATHs, IMAGES synthetic JPEGs of the given size (24 MP by default) are generated. Every image is also
+rotated forth and back losslessly, and the decoded pixels are checked to be the same as the original ones.
+"""
+
+import sys, os, time, random, cStringIO, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+import Image
+from transform import ORIENTATION_TRANSFORMS, lossless_rotate, jpegtran
+
+INVERSE = {2: 2, 3: 3, 4: 4, 5: 5, 6: 8, 7: 7, 8: 6}
+
+def synthetic(count, size, seed = 0):
+	rng = random.Random(seed)
+	for i in xrange(count):
+		image = Image.new('RGB', (size[0] / 16, size[1] / 16))
+		image.putdata([(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)) for p in xrange(image.size[0] * image.size[1])])
+		photo = cStringIO.StringIO()
+		image.resize(size, Image.BILINEAR).save(photo, 'JPEG', quality = 95)
+		yield photo.getvalue()
+
+def with_pil(data, orientation):
+	image = Image.open(cStringIO.StringIO(data))
+	for t in ORIENTATION_TRANSFORMS[orientation]:
+		image = image.transpose(getattr(Image, t))
+	photo = cStringIO.StringIO()
+	image.save(photo, 'JPEG', quality = 95)
+	return photo.getvalue()
+
+def pixels(data):
+	return Image.open(cStringIO.StringIO(data)).tostring()
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark lossless JPEG rotation')
+	parser.add_argument('-n', '--images', type = int, default = 8, help = 'Number of synthetic images')
+	parser.add_argument('-s', '--size', default = '6000x4000', help = 'Size of the synthetic images')
+	parser.add_argument('-o', '--orientation', type = int, default = 6, choices = range(2, 9), help = 'EXIF orientation to undo')
+	parser.add_argument('paths', metavar = 'PATH', nargs = '*', help = 'JPEG files to use instead of synthetic ones')
+	args = parser.parse_args()
+
+	if not jpegtran():
+		raise SystemExit('jpegtran is not installed')
+	if args.paths:
+		images = [open(path, 'rb').read() for path in args.paths]
+	else:
+		images = list(synthetic(args.images, map(int, args.size.split('x'))))
+
+	start = time.time()
+	for data in images:
+		with_pil(data, args.orientation)
+	slow = time.time() - start
+	start = time.time()
+	rotated = [lossless_rotate(data, args.orientation) for data in images]
+	fast = time.time() - start
+
+	exact = 0
+	for data, result in zip(images, rotated):
+		if result is not None and pixels(lossless_rotate(result, INVERSE[args.orientation])) == pixels(data):
+			exact += 1
+	print '{} images, {} rotated losslessly, {} with the same pixels after rotating back'.format(len(images), sum(1 for r in rotated if r is not None), exact)
+	print 'PIL:      {:8.3f}s {:8.2f} images/s'.format(slow, len(images) / slow)
+	print 'jpegtran: {:8.3f}s {:8.2f} images/s'.format(fast, len(images) / fast)
+	print 'speedup:  {:8.1f}x'.format(slow / fast)
+
+if __name__ == '__main__':
+	main()
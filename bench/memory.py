@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+"""Measure the memory held by the photos of a synced album, with whole gdata entries and with compact records.
+
+usage: memory.py [-n PHOTOS[,PHOTOS...]] [-k DIR]
+
+For every number of photos an album of empty files is created, with a state database holding every file as synced,
+like after a first sync. Every case then runs in a fresh process which parses synthetic photo feeds of 1000 entries,
+the size of a Picasa page, and keeps one photo per entry with its disk and remote sides, reading the disk side from
+the state database the way a sync does by default. "entries" keeps every parsed gdata entry and the stat result and
+state record of every file in photos with an instance __dict__, the way photos used to be held. "compact" keeps the
+__slots__ records used now. The growth of the peak RSS is reported, in total and per photo.
+"""
+
+import sys, os, resource, subprocess, argparse, tempfile, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+PAGE = 1000
+ENTRY = (u"<entry><id>http://picasaweb.google.com/data/entry/api/user/default/albumid/1/photoid/{id}</id>"
+	u"<updated>2012-01-01T00:00:00.000Z</updated><category scheme='http://schemas.google.com/g/2005#kind' term='http://schemas.google.com/photos/2007#photo'/>"
+	u"<title type='text'>IMG_{id:07d}.jpg</title><summary type='text'></summary>"
+	u"<content type='image/jpeg' src='https://lh3.googleusercontent.com/photo/{id}/IMG_{id:07d}.jpg'/>"
+	u"<link rel='http://schemas.google.com/g/2005#feed' type='application/atom+xml' href='http://picasaweb.google.com/data/feed/api/user/default/albumid/1/photoid/{id}'/>"
+	u"<link rel='alternate' type='text/html' href='http://picasaweb.google.com/default/Album#{id}'/>"
+	u"<link rel='self' type='application/atom+xml' href='http://picasaweb.google.com/data/entry/api/user/default/albumid/1/photoid/{id}'/>"
+	u"<link rel='edit' type='application/atom+xml' href='http://picasaweb.google.com/data/entry/api/user/default/albumid/1/photoid/{id}/1'/>"
+	u"<link rel='edit-media' type='image/jpeg' href='http://picasaweb.google.com/data/media/api/user/default/albumid/1/photoid/{id}/1'/>"
+	u"<gphoto:id>{id}</gphoto:id><gphoto:version>1</gphoto:version><gphoto:albumid>1</gphoto:albumid><gphoto:width>4000</gphoto:width>"
+	u"<gphoto:height>3000</gphoto:height><gphoto:size>{size}</gphoto:size><gphoto:client>picasasync</gphoto:client>"
+	u"<gphoto:checksum>{checksum:040x}</gphoto:checksum><gphoto:timestamp>{timestamp}</gphoto:timestamp><gphoto:imageVersion>1</gphoto:imageVersion>"
+	u"<gphoto:commentingEnabled>true</gphoto:commentingEnabled><gphoto:commentCount>0</gphoto:commentCount></entry>")
+FEED = (u"<?xml version='1.0' encoding='UTF-8'?><feed xmlns='http://www.w3.org/2005/Atom' xmlns:gphoto='http://schemas.google.com/photos/2007'>"
+	u"<id>http://picasaweb.google.com/data/feed/api/user/default/albumid/1</id><title type='text'>Album</title>{}</feed>")
+
+class DictDiskEntry(object):
+	def __init__(self, path, timestamp, stat, record):
+		self.path = path
+		self.timestamp = timestamp
+		self.stat = stat
+		self.record = record
+
+class DictPhoto(object):
+	def __init__(self, album, title, disk, picasa):
+		self.album = album
+		self.disk = disk
+		self.picasa = picasa
+		self.raw = False
+		self.moved_from = None
+		self.title = title
+
+def feed(start, count):
+	entries = u''.join(ENTRY.format(id = 100000000 + i, size = 4000000 + i, checksum = i * 2654435761, timestamp = (1325376000 + i) * 1000) for i in xrange(start, start + count))
+	return FEED.format(entries).encode('utf-8')
+
+def populate(work, count):
+	"""Create the files of the album and a state database where all of them are synced."""
+	from state import StateDB
+	directory = os.path.join(work, 'Album')
+	os.makedirs(directory)
+	state = StateDB(os.path.join(work, 'state.db'))
+	for i in xrange(count):
+		path = os.path.join(directory, u'IMG_{:07d}.jpg'.format(100000000 + i))
+		open(path, 'w').close()
+		st = os.stat(path)
+		state.store(path, st, ['stat'], int(st.st_mtime), 'image/jpeg')
+		state.markSynced(path, st, str(100000000 + i), (1325376000 + i) * 1000)
+		state.storeFingerprint(path, st.st_size, st.st_mtime, st.st_ino, '{:040x}'.format(i * 2654435761))
+	state.close()
+
+def rss():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(mode, count, work):
+	import gdata.photos
+	from PicasaSync import Album, Photo, PhotoDiskEntry, PhotoPicasaEntry
+	from state import StateDB
+
+	cl_args = argparse.Namespace(origin = ['stat'])
+	directory = os.path.join(work, 'Album')
+	state = StateDB(os.path.join(work, 'state.db'))
+	# Parse one page and look up one file first, so the imports, the parser and the database are not counted
+	gdata.photos.PhotoFeedFromString(feed(0, min(PAGE, count)))
+	PhotoDiskEntry(cl_args, u'IMG_{:07d}.jpg'.format(100000000), directory, state)
+	album = Album(None, u'Album')
+	before = rss()
+	for start in xrange(0, count, PAGE):
+		for entry in gdata.photos.PhotoFeedFromString(feed(start, min(PAGE, count - start))).entry:
+			name = entry.title.text
+			title = os.path.splitext(name)[0]
+			if mode == 'compact':
+				album[title] = Photo(album, title, disk = PhotoDiskEntry(cl_args, name, directory, state), picasa = PhotoPicasaEntry(entry))
+			else:
+				path = os.path.join(directory, name)
+				st = os.stat(path)
+				album[title] = DictPhoto(album, title, DictDiskEntry(name, int(st.st_mtime), st, state.lookup(path, st, cl_args.origin)), entry)
+	return rss() - before
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark the memory held by the photos of an album')
+	parser.add_argument('-n', '--photos', default = '100000,500000', help = 'Comma separated numbers of photos')
+	parser.add_argument('-k', '--keep', metavar = 'DIR', help = 'Create the albums in DIR and keep them, instead of a temporary directory')
+	parser.add_argument('--mode', choices = ('entries', 'compact'), help = argparse.SUPPRESS)
+	parser.add_argument('--work', help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.mode:
+		print measure(args.mode, int(args.photos), args.work)
+		return
+	work = args.keep or tempfile.mkdtemp(prefix = 'picasasync-memory-')
+	try:
+		for count in map(int, args.photos.split(',')):
+			album = os.path.join(work, str(count))
+			populate(album, count)
+			for mode in ('entries', 'compact'):
+				growth = int(subprocess.check_output([sys.executable, os.path.abspath(__file__), '--mode', mode, '-n', str(count), '--work', album]))
+				print '{:>8} photos {:<8} {:9.1f} MB {:8.0f} bytes per photo'.format(count, mode, growth / 1024.0, growth * 1024.0 / count)
+	finally:
+		if not args.keep:
+			shutil.rmtree(work, ignore_errors = True)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+"""Compare resizing JPEGs from a full decode with resizing them from a DCT scaled (draft mode) decode.
+
+usage: resize.py [-n IMAGES] [-s WIDTHxHEIGHT] [-m WIDTHxHEIGHT] [-w WORKERS] [PATH ...]
+
+Without PATHs, IMAGES synthetic JPEGs of the given size are generated. Both ways are timed over every image in a
+pool of WORKERS processes and reported in images per second and per core.
+"""
+
+import sys, os, time, random, cStringIO, multiprocessing, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync'))
+
+import Image
+from transform import open_scaled
+
+def synthetic(count, size, seed = 0):
+	rng = random.Random(seed)
+	for i in xrange(count):
+		image = Image.new('RGB', (size[0] / 16, size[1] / 16))
+		image.putdata([(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)) for p in xrange(image.size[0] * image.size[1])])
+		photo = cStringIO.StringIO()
+		image.resize(size, Image.BILINEAR).save(photo, 'JPEG', quality = 95)
+		yield photo.getvalue()
+
+def full((data, max_size)):
+	image = Image.open(cStringIO.StringIO(data))
+	image.load()
+	image.thumbnail(max_size, Image.ANTIALIAS)
+	photo = cStringIO.StringIO()
+	image.save(photo, 'JPEG', quality = 95)
+	return image.size
+
+def scaled((data, max_size)):
+	image = open_scaled(cStringIO.StringIO(data), max_size)
+	image.thumbnail(max_size, Image.ANTIALIAS)
+	photo = cStringIO.StringIO()
+	image.save(photo, 'JPEG', quality = 95)
+	return image.size
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark JPEG resizing')
+	parser.add_argument('-n', '--images', type = int, default = 16, help = 'Number of synthetic images')
+	parser.add_argument('-s', '--size', default = '6000x4000', help = 'Size of the synthetic images')
+	parser.add_argument('-m', '--max-size', default = '2048x2048', help = 'Size to resize to')
+	parser.add_argument('-w', '--workers', type = int, default = multiprocessing.cpu_count(), help = 'Number of processes')
+	parser.add_argument('paths', metavar = 'PATH', nargs = '*', help = 'JPEG files to use instead of synthetic ones')
+	args = parser.parse_args()
+
+	if args.paths:
+		images = [open(path, 'rb').read() for path in args.paths]
+	else:
+		images = list(synthetic(args.images, map(int, args.size.split('x'))))
+	max_size = map(int, args.max_size.split('x'))
+	work = [(data, max_size) for data in images]
+
+	pool = multiprocessing.Pool(args.workers)
+	try:
+		for name, resize in (('full decode', full), ('draft decode', scaled)):
+			start = time.time()
+			sizes = pool.map(resize, work)
+			elapsed = time.time() - start
+			print '{:<13} {:8.3f}s {:8.2f} images/s {:8.2f} images/s per core, {}x{} output'.format(name, elapsed, len(work) / elapsed, len(work) / elapsed / args.workers, *sizes[0])
+	finally:
+		pool.terminate()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+"""Measure the startup time of PicasaSync in fresh interpreters.
+
+usage: startup.py [-r ROUNDS] [PATH]
+
+Importing the module is compared with importing every heavy dependency up front, as the module used to do. With PATH
+a whole --status run over it is timed too.
+"""
+
+import sys, os, time, subprocess, argparse
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync')
+
+EAGER = 'import googlecl.authentication, googlecl.config, googlecl.picasa.service, gdata.photos.service, pyexiv2, dateutil.parser, Image'
+LAZY = 'import PicasaSync'
+
+def timed(command, rounds):
+	times = []
+	env = dict(os.environ, PYTHONPATH = os.pathsep.join([PACKAGE] + filter(None, [os.environ.get('PYTHONPATH')])))
+	with open(os.devnull, 'w') as devnull:
+		for i in xrange(rounds):
+			start = time.time()
+			subprocess.call(command, env = env, stdout = devnull, stderr = devnull)
+			times.append(time.time() - start)
+	times.sort()
+	return times[0], times[len(times) / 2]
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark PicasaSync startup')
+	parser.add_argument('-r', '--rounds', type = int, default = 10, help = 'Runs of every command, the best and the median are reported')
+	parser.add_argument('path', metavar = 'PATH', nargs = '?', help = 'Local albums to run --status on')
+	args = parser.parse_args()
+
+	commands = [
+		('python', [sys.executable, '-c', 'pass']),
+		('eager imports', [sys.executable, '-c', EAGER]),
+		('import PicasaSync', [sys.executable, '-c', LAZY]),
+	]
+	if args.path:
+		commands.append(('--status', [sys.executable, os.path.join(PACKAGE, 'PicasaSync.py'), '--status', args.path]))
+	for name, command in commands:
+		best, median = timed(command, args.rounds)
+		print '{:<20} best {:7.3f}s median {:7.3f}s'.format(name, best, median)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+"""Measure whole PicasaSync runs against the local stand-in server of fakepicasa.py.
+
+usage: sync.py [-a ALBUMS] [-p PHOTOS] [-s SIZE] [-r RATIO] [-t THREADS] [-l SECONDS] [-b BYTES] [-e RATE] [-k DIR] [-- ARGS ...]
+
+A synthetic tree of ALBUMS albums with PHOTOS photos each is generated, with JPEGs and a RATIO of NEFs, all of them
+with EXIF dates and a mix of orientations. NEFs are only synced when ARGS include --transform raw. These phases are run
+in order, each one in a fresh process:
+
+  scan      plan an upload without state database, reading every local photo and listing the empty account
+  upload    upload the whole tree
+  resync    sync again without any change
+  delete    remove the first local JPEG of every album and delete it from Picasa, in batches
+  metadata  force a metadata update of every photo, fetching and updating the entries in batches
+  list      plan a download into an empty directory, listing every album and photo
+  download  download everything into that directory
+
+For every phase the wall time, the requests and bytes seen by the server and the peak RSS of the process are reported.
+The delete and metadata phases also check that the server saw their changes, and the exit status is 1 when a phase
+failed, logged a traceback or left the server without its changes.
+"""
+
+import sys, os, time, random, struct, shutil, tempfile, subprocess, argparse
+
+from fakepicasa import FakePicasa, _parse_size
+
+PICASASYNC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PicasaSync', 'PicasaSync.py')
+
+ORIENTATIONS = (1, 1, 1, 3, 6, 8)
+
+def tiff(orientation, date):
+	"""Little endian TIFF structure with the camera, orientation and dates of a photo."""
+	date += '\x00'
+	make = 'NIKON CORPORATION\x00'
+	ifd0 = 8
+	exif_ifd = ifd0 + 2 + 4 * 12 + 4
+	data = exif_ifd + 2 + 12 + 4
+	entries = struct.pack('<H', 4)
+	entries += struct.pack('<HHII', 0x010f, 2, len(make), data)
+	entries += struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0)
+	entries += struct.pack('<HHII', 0x0132, 2, len(date), data + len(make))
+	entries += struct.pack('<HHII', 0x8769, 4, 1, exif_ifd)
+	entries += struct.pack('<I', 0)
+	exif = struct.pack('<HHHII', 1, 0x9003, 2, len(date), data + len(make) + len(date)) + struct.pack('<I', 0)
+	return 'II*\x00' + struct.pack('<I', ifd0) + entries + exif + make + date + date
+
+def jpeg(orientation, date, size):
+	"""Structurally valid JPEG with EXIF, whose scan data is random bytes up to size."""
+	exif = 'Exif\x00\x00' + tiff(orientation, date)
+	header = '\xff\xd8' + '\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif + '\xff\xda' + struct.pack('>H', 2)
+	# Random scan data without markers
+	body = os.urandom(max(0, size - len(header) - 2)).replace('\xff', '\x00')
+	return header + body + '\xff\xd9'
+
+def nef(orientation, date, size):
+	data = tiff(orientation, date)
+	return data + os.urandom(max(0, size - len(data)))
+
+def generate(path, albums, photos, size, nef_ratio, seed = 0):
+	rng = random.Random(seed)
+	start = time.mktime((2012, 1, 1, 0, 0, 0, 0, 0, -1))
+	total = 0
+	for a in xrange(albums):
+		album = os.path.join(path, 'Album {:04d}'.format(a))
+		os.makedirs(album)
+		for p in xrange(photos):
+			date = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(start + (a * photos + p) * 60))
+			orientation = rng.choice(ORIENTATIONS)
+			if rng.random() < nef_ratio:
+				name, data = 'DSC_{:04d}.NEF'.format(p), nef(orientation, date, size)
+			else:
+				name, data = 'IMG_{:04d}.jpg'.format(p), jpeg(orientation, date, size)
+			with open(os.path.join(album, name), 'wb') as f:
+				f.write(data)
+			total += len(data)
+	return total
+
+def remove_first(path):
+	"""Delete the first JPEG of every album under path, which is uploaded whatever the transforms, and return how many."""
+	removed = 0
+	for album in sorted(os.listdir(path)):
+		album = os.path.join(path, album)
+		if os.path.isdir(album):
+			photos = sorted(f for f in os.listdir(album) if f.endswith('.jpg'))
+			if photos:
+				os.remove(os.path.join(album, photos[0]))
+				removed += 1
+	return removed
+
+def tracebacks(path, offset):
+	"""Number of tracebacks logged in path after offset."""
+	with open(path) as f:
+		f.seek(offset)
+		return sum(1 for line in f if line.startswith('Traceback'))
+
+def run(command, log):
+	"""Run command and return its exit status and peak RSS in kilobytes."""
+	process = subprocess.Popen(command, stdout = log, stderr = subprocess.STDOUT)
+	pid, status, usage = os.wait4(process.pid, 0)
+	process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+	return process.returncode, usage.ru_maxrss
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Benchmark whole syncs against a fake Picasa server')
+	parser.add_argument('-a', '--albums', type = int, default = 10, help = 'Number of albums')
+	parser.add_argument('-p', '--photos', type = int, default = 50, help = 'Number of photos per album')
+	parser.add_argument('-s', '--size', type = _parse_size, default = 256 << 10, help = 'Size of every photo (K, M or G suffixes allowed)')
+	parser.add_argument('-r', '--nef-ratio', type = float, default = 0.2, help = 'Fraction of the photos that are NEFs')
+	parser.add_argument('-t', '--threads', type = int, default = 4, help = 'Photo processing threads of the syncs')
+	parser.add_argument('-l', '--latency', type = float, default = 0.0, help = 'Seconds the server adds to every request')
+	parser.add_argument('-b', '--bandwidth', type = _parse_size, default = 0, help = 'Bytes per second of every transfer, 0 for no limit')
+	parser.add_argument('-e', '--error-rate', type = float, default = 0.0, help = 'Fraction of the requests answered with 503')
+	parser.add_argument('-k', '--keep', metavar = 'DIR', help = 'Work in DIR and keep the trees and logs, instead of a temporary directory')
+	parser.add_argument('args', metavar = 'ARGS', nargs = argparse.REMAINDER, help = 'More PicasaSync arguments for every phase, after --')
+	args = parser.parse_args()
+	extra = [arg for arg in args.args if arg != '--']
+
+	work = args.keep or tempfile.mkdtemp(prefix = 'picasasync-bench-')
+	local = os.path.join(work, 'local')
+	remote = os.path.join(work, 'download')
+	state = os.path.join(work, 'state.db')
+	try:
+		start = time.time()
+		total = generate(local, args.albums, args.photos, args.size, args.nef_ratio)
+		os.makedirs(remote)
+		print 'Generated {} photos, {:.1f} MB in {:.2f}s under {}'.format(args.albums * args.photos, total / 1e6, time.time() - start, work)
+
+		server = FakePicasa(latency = args.latency, bandwidth = args.bandwidth, error_rate = args.error_rate).start()
+		sync = [sys.executable, PICASASYNC, '--server', server.url, '-t', str(args.threads)] + extra
+		store = server.store
+		stamps = {}
+		def prepare_delete():
+			stamps['left'] = len(store.photos) - remove_first(local)
+		def check_delete():
+			if len(store.photos) != stamps['left']:
+				return '{} photos left on the server instead of {}'.format(len(store.photos), stamps['left'])
+		def prepare_metadata():
+			stamps.clear()
+			stamps.update((photo['id'], photo['updated']) for photo in store.photos.itervalues())
+		def check_metadata():
+			stale = sum(1 for photo in store.photos.itervalues() if stamps.get(photo['id']) == photo['updated'])
+			if stale:
+				return '{} photos were not updated'.format(stale)
+		phases = (
+			('scan', ['-u', '--no-state-db', '--plan', os.path.join(work, 'scan.plan'), local], None, None),
+			('upload', ['-u', '--state-db', state, local], None, None),
+			('resync', ['-u', '-r', '--state-db', state, local], None, None),
+			('delete', ['-u', '--delete-photos', '--state-db', state, local], prepare_delete, check_delete),
+			('metadata', ['-u', '--force-update', 'metadata', '--state-db', state, local], prepare_metadata, check_metadata),
+			('list', ['-d', '--no-state-db', '--plan', os.path.join(work, 'list.plan'), remote], None, None),
+			('download', ['-d', '--no-state-db', remote], None, None),
+		)
+
+		print '{:<9} {:>9} {:>9} {:>8} {:>11} {:>11} {:>10} {:>6}'.format('phase', 'wall (s)', 'requests', 'errors', 'sent (MB)', 'recv (MB)', 'RSS (MB)', 'status')
+		problems = []
+		log_path = os.path.join(work, 'sync.log')
+		with open(log_path, 'w') as log:
+			for name, command, prepare, check in phases:
+				if prepare:
+					prepare()
+				log.write('=== {}\n'.format(name))
+				log.flush()
+				offset = log.tell()
+				before = server.store.counters()
+				start = time.time()
+				status, rss = run(sync + command, log)
+				elapsed = time.time() - start
+				after = server.store.counters()
+				delta = dict((key, after[key] - before[key]) for key in after)
+				# Sent and received are seen from PicasaSync
+				print '{:<9} {:9.2f} {:9d} {:8d} {:11.2f} {:11.2f} {:10.1f} {:6d}'.format(name, elapsed, delta['requests'], delta['errors'],
+					delta['bytes_in'] / 1e6, delta['bytes_out'] / 1e6, rss / 1024.0, status)
+				if status:
+					problems.append('{}: exit status {}'.format(name, status))
+				count = tracebacks(log_path, offset)
+				if count:
+					problems.append('{}: {} tracebacks in {}'.format(name, count, log_path))
+				problem = check() if check else None
+				if problem:
+					problems.append('{}: {}'.format(name, problem))
+		server.shutdown()
+		for problem in problems:
+			print problem
+		if problems:
+			sys.exit(1)
+	finally:
+		if not args.keep:
+			shutil.rmtree(work, ignore_errors = True)
+
+if __name__ == '__main__':
+	main()